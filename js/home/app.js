@@ -11,8 +11,18 @@ const home = (_ => {
 
     if (util.isPath('dashboard')){
       let chartPeriod = $('.chart').data('period')
-      fetch(`/api/trend/?period=${chartPeriod}`)
-        .then(data => data.json())
+      let chartParams = $.param({
+        period: chartPeriod,
+        start: $('.chart').data('start') || '',
+        end: $('.chart').data('end') || '',
+      })
+      // The series usually comes with the page; otherwise ask the API, revalidating
+      // the browser's copy (unchanged data comes back as a 304)
+      let inline = document.getElementById('chart-data')
+      let series = inline ? Promise.resolve(JSON.parse(inline.textContent)) :
+        fetch(`/api/trend/?${chartParams}`, {credentials: 'same-origin', cache: 'no-cache'})
+          .then(data => data.json())
+      series
         .then(data => chart.makeChart($('.chart'), data, 
           chartPeriod[0].toUpperCase() + chartPeriod.slice(1)))
     }
@@ -42,7 +52,7 @@ const home = (_ => {
           }
         })
       });
-    } else if (util.isPath('personList') || util.isPath('conversationList')){
+    } else if (util.isPath('personList') || util.isPath('conversationList') || util.isPath('search')){
       initSelect2();
       $('button.btn-input').on('click', function(){
         let $div = $(this).closest('div')
@@ -70,7 +80,7 @@ const home = (_ => {
     $('select.select2-enable').select2({width: '100%'});
     $('select.select2-enable').each((i, e) => {
       var element = $(e);
-      var options = { };
+      var options = remoteOptions(element);
       var control = element.select2(options);
     
       if (control.first().prop("multiple")){
@@ -82,22 +92,69 @@ const home = (_ => {
     });
   }
 
+  // Options for selects that fetch their choices page by page from a JSON endpoint
+  function remoteOptions(element){
+    let url = element.data('ajax-url');
+    if (!url){
+      return {};
+    }
+    let nextCursor = null;
+    return {
+      width: '100%',
+      allowClear: !element.prop('multiple'),
+      placeholder: '',
+      ajax: {
+        dataType: 'json',
+        // Keep the browser cache; the API answers unchanged pages with a 304
+        cache: true,
+        delay: 150,
+        url: url,
+        data: function (params) {
+          let query = {
+            q: (params.term || '').trim(),
+            key: 'pk',
+            exclude: element.data('exclude') || '',
+          };
+          if (params.page > 1 && nextCursor){
+            query.cursor = nextCursor;
+          }
+          return query;
+        },
+        processResults: function(data){
+          nextCursor = data.next_cursor;
+          return {
+            results: data.people.map(p => ({id: p.id, text: p.name})),
+            pagination: {
+              more: data.more_results,
+            }
+          };
+        },
+      },
+    };
+  }
+
   function initSearchBar(){
+    let nextCursor = null;
     $(".navbar-form .api-search").select2({
       ajax: {
         dataType: 'json',
+        cache: true,
         delay: 150,
         url: "/api/people/",
         minimumInputLength: 1,
         data: function (params) {
           params.term = params.term || '';
-          return {
+          let query = {
             q: params.term.trim(),
-            page: params.page || 1,
           };
+          if (params.page > 1 && nextCursor){
+            query.cursor = nextCursor;
+          }
+          return query;
         },
         processResults: function(data, params){
           params.page = params.page || 1;
+          nextCursor = data.next_cursor;
           // add links
           var people = data.people.map(p => {
             p.url = '/people/' + p.id;
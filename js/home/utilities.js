@@ -5,6 +5,8 @@ module.exports = (_ => {
       $('.navbar-nav .people').addClass('active')
     } else if (isPath('conversations')){
       $('.navbar-nav .conversations').addClass('active')
+    } else if (isPath('search')){
+      $('.navbar-nav .search').addClass('active')
     }
   }
 
@@ -18,6 +20,7 @@ module.exports = (_ => {
     personEdit: /^\/people\/([\w-]+\/)?(edit|add)\//,
     conversationEdit: /^\/conversations\/(\w{3,}\/)?(edit|add)\//,
     conversationCreate: /^\/conversations\/add\//,
+    search: /^\/search\//,
   }
 
   function isPath(page, path = window.location.pathname) {
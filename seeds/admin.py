@@ -21,8 +21,8 @@ class GroupInline(admin.TabularInline):
     extra = 0
 
 class PersonAdmin(AuditingAdminModelMixin, admin.ModelAdmin):
-    readonly_fields = auditing_fields + ['level']
-    list_display = ['name', 'city', 'company']
+    readonly_fields = auditing_fields + ['level', 'num_conversations', 'first_contact', 'last_contact']
+    list_display = ['name', 'city', 'company', 'last_contact']
     search_fields = ['name']
     list_filter = ('sectors', 'city', 'company')
     inlines = (GroupInline,)
@@ -35,6 +35,11 @@ class PersonAdmin(AuditingAdminModelMixin, admin.ModelAdmin):
             'slug',
             'level',
         ]}), 
+        ('Contact history', { 'fields': [
+            'num_conversations',
+            'first_contact',
+            'last_contact',
+        ]}),
         ('Personal information', { 'fields': [
             'partner',
             'known_via',
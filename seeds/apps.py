@@ -0,0 +1,14 @@
+"""App configuration."""
+from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_migrate
+
+class SeedsConfig(AppConfig):
+    name = 'seeds'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .database import configure_sqlite
+        from .search import create_table
+        post_migrate.connect(create_table, sender=self)
+        connection_created.connect(configure_sqlite)
@@ -0,0 +1,82 @@
+"""In-memory prefix index answering the people typeahead without the database."""
+import heapq
+import unicodedata
+from bisect import bisect_left
+
+from django.conf import settings
+
+from .models import Person
+from .utils import UserObjects
+
+# Number of users whose index each process keeps
+AUTOCOMPLETE_CACHE_SIZE = getattr(settings, 'AUTOCOMPLETE_CACHE_SIZE', 50)
+
+def normalize(text):
+    """Lowercase, fold accents and collapse whitespace, e.g. 'Zoë  Ng' -> 'zoe ng'."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.lower().split())
+
+class PersonIndex(object):
+    """Sorted array of name tokens for one user's people.
+
+    People are ranked once, by number of conversations then name, so a lookup
+    is a binary search for the prefix followed by picking the best ranks.
+    """
+    def __init__(self, people):
+        self.people = []
+        self.rank_of = {}
+        entries = set()
+        for rank, person in enumerate(people):
+            self.people.append({'name': person.name, 'slug': person.slug, 'pk': person.pk})
+            self.rank_of[person.pk] = rank
+            first, last = normalize(person.first_name), normalize(person.last_name)
+            tokens = set(first.split() + last.split())
+            tokens.update([first, last, normalize(person.name), (first + ' ' + last).strip()])
+            entries.update((token, rank) for token in tokens if token)
+
+        entries = sorted(entries)
+        self.tokens = [token for token, _ in entries]
+        self.ranks = [rank for _, rank in entries]
+
+    @classmethod
+    def build(cls, user):
+        people = (Person.objects.for_user(user)
+            .select_related('partner', 'known_via', 'company')
+            .order_by('-num_conversations', 'first_name', 'last_name'))
+        return cls(people)
+
+    def search(self, q, offset=0, limit=8, after=-1, exclude=None):
+        """Return the best matches of prefix `q` ranked below `after`, skipping `offset`.
+
+        The person with pk `exclude` is left out before paging. Also returns the
+        rank to pass as `after` for the next page, or None if there are no more
+        matches.
+        """
+        skip = self.rank_of.get(exclude)
+        q = normalize(q)
+        if q:
+            ranks = set()
+            i = bisect_left(self.tokens, q)
+            while i < len(self.tokens) and self.tokens[i].startswith(q):
+                if self.ranks[i] > after and self.ranks[i] != skip:
+                    ranks.add(self.ranks[i])
+                i += 1
+            ranks = heapq.nsmallest(offset + limit + 1, ranks)
+        else:
+            end = min(after + 1 + offset + limit + 2, len(self.people))
+            ranks = [rank for rank in range(after + 1, end) if rank != skip][:offset + limit + 1]
+
+        page = ranks[offset:offset + limit]
+        people = [self.people[rank] for rank in page]
+        return people, page[-1] if len(ranks) > offset + limit else None
+
+_indexes = UserObjects(PersonIndex.build, AUTOCOMPLETE_CACHE_SIZE)
+
+def get_index(user):
+    """Return the user's index, rebuilding it if the user's data changed since.
+
+    Keystrokes within GENERATION_CHECK_INTERVAL of each other reuse the last
+    generation check; see UserObjects.
+    """
+    return _indexes.get(user)
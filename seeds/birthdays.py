@@ -0,0 +1,35 @@
+"""Upcoming birthdays, found through `Person.birthday_key`.
+
+Birthdays are entered with any year when it is unknown, so only their month
+and day mean anything and a date range cannot find them. `birthday_key` stores
+the month and day as one number, MMDD (April 12 is 412), which sorts like the
+calendar and is indexed per user: the next N days are one range of keys, or
+two when they run past December 31.
+"""
+from calendar import isleap
+from datetime import date, timedelta
+
+def day_key(day):
+    """The MMDD key of a date, or None."""
+    return day.month * 100 + day.day if day else None
+
+def key_ranges(start, days):
+    """The inclusive (low, high) key ranges of the `days` days from `start`, in date order."""
+    end = start + timedelta(days=min(days, 365) - 1)
+    low, high = day_key(start), day_key(end)
+    if low == 301 and not isleap(start.year):
+        # February 29 birthdays fall on March 1 in other years
+        low = 229
+    if end.year == start.year:
+        return [(low, high)]
+    return [(low, 1231), (101, high)]
+
+def next_birthday(birthday, today):
+    """The first anniversary of `birthday` on or after `today`."""
+    for year in (today.year, today.year + 1):
+        try:
+            day = birthday.replace(year=year)
+        except ValueError:
+            day = date(year, 3, 1)
+        if day >= today:
+            return day
@@ -0,0 +1,10 @@
+"""Template context shared by every page."""
+from django.utils.functional import SimpleLazyObject
+
+from . import fragments
+
+def fragment_version(request):
+    """`fragment_version` for the cached list items; only looked up if a page shows some."""
+    if not request.user.is_authenticated:
+        return {}
+    return {'fragment_version': SimpleLazyObject(lambda: fragments.version(request.user))}
@@ -0,0 +1,136 @@
+"""The dashboard's data, with its independent queries run side by side.
+
+Each part is loaded by a small pool of threads shared by the process. Queries
+release the GIL while the database works, so the page waits about as long as
+its slowest part rather than the sum of all of them. Django connections belong
+to a thread: each task reads through the same alias as the request and closes
+or keeps its connection afterwards as a request would (CONN_MAX_AGE).
+
+DASHBOARD_WORKERS = 0 loads the parts one after the other in the request's
+thread, as does any call inside a transaction, whose writes other connections
+cannot see yet.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connections
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import database
+from .models import Person, Conversation, ConversationRollup
+from .utils import PERIOD_STARTS, count_by_period, count_orbits, period_range, user_cache
+
+# Put the trend series in the page so the chart needs no request of its own
+DASHBOARD_INLINE_CHART = getattr(settings, 'DASHBOARD_INLINE_CHART', True)
+
+# The executor and the process it was started in
+_pool = {'executor': None, 'pid': None}
+_pool_lock = threading.Lock()
+
+def get_workers():
+    # Read on each call so the query audit can turn the pool off
+    return getattr(settings, 'DASHBOARD_WORKERS', 4)
+
+def get_pool():
+    with _pool_lock:
+        # Threads do not survive a fork, e.g. of preloaded gunicorn workers
+        if _pool['executor'] is None or _pool['pid'] != os.getpid():
+            _pool['executor'] = ThreadPoolExecutor(max_workers=get_workers(),
+                thread_name_prefix='dashboard')
+            _pool['pid'] = os.getpid()
+        return _pool['executor']
+
+def _run(func, reading, wrappers):
+    """Call func in a pool thread the way the request would have."""
+    database.set_reading(reading)
+    close_old_connections()
+    try:
+        with ExitStack() as stack:
+            # Query timers of the request, e.g. the metrics middleware's
+            for alias, alias_wrappers in wrappers.items():
+                for wrapper in alias_wrappers:
+                    stack.enter_context(connections[alias].execute_wrapper(wrapper))
+            return func()
+    finally:
+        close_old_connections()
+        database.set_reading(False)
+
+def run_all(parts):
+    """Call each function of {name: func} side by side and return {name: result}."""
+    if get_workers() < 1 or any(connections[alias].in_atomic_block for alias in connections):
+        return {name: func() for name, func in parts.items()}
+
+    reading = database.get_reading()
+    wrappers = {alias: list(connections[alias].execute_wrappers) for alias in connections}
+    pool = get_pool()
+    futures = {name: pool.submit(_run, func, reading, wrappers) for name, func in parts.items()}
+    return {name: future.result() for name, future in futures.items()}
+
+def _parse_day(value):
+    """An ISO date, or None if empty; raises ValueError for anything else."""
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError(value)
+    return day
+
+def chart_range(period, start, end, max_periods=500):
+    """Check a chart's period and optional ISO date bounds; return [start, end) as dates.
+
+    Raises ValueError with a message for the user.
+    """
+    if period not in PERIOD_STARTS:
+        raise ValueError('Unknown period "{0}".'.format(period))
+    try:
+        start, end = _parse_day(start), _parse_day(end)
+    except ValueError:
+        raise ValueError('Invalid date range.')
+    if start and end and start >= end:
+        raise ValueError('Invalid date range.')
+
+    try:
+        start, end = period_range(period, start, end)
+        too_long = PERIOD_STARTS[period](start, offset=max_periods) < end
+    except (ValueError, OverflowError):
+        # Widening to whole periods went past year 1 or 9999
+        raise ValueError('Dates out of range.')
+    if too_long:
+        raise ValueError('Too many periods; use a coarser one.')
+    return start, end
+
+def trend(user, period, start, end, by_mode=False):
+    """Conversation counts per period in [start, end), as the trend chart reads them."""
+    def compute():
+        rows = ConversationRollup.objects.counts(user, period, start, end)
+        return count_by_period(rows, period, start, end, by_mode=by_mode)
+    return user_cache(user, ('trend', period, start, end, by_mode), compute)
+
+def load(user, chart=None):
+    """Return the dashboard's lists and counts; with chart=(period, start, end), the trend too."""
+    today = timezone.now().date()
+    parts = {
+        'new_people': lambda: list(Person.objects.for_user(user)
+            .select_related('partner', 'known_via', 'company')
+            .filter(created_on__gte=timezone.now() - timedelta(days=30))
+            .order_by('-created_on')[:4]),
+        'conversation_list': lambda: list(Conversation.objects.for_user(user)
+            .filter(seed=False)[:4]),
+        'pings': lambda: list(Person.objects.for_user(user)
+            .select_related('partner', 'known_via', 'company')
+            .filter(last_contact__lt=today - timedelta(days=91),
+                last_contact__gte=today - timedelta(days=365.24*3))
+            .order_by('-level')[:4]),
+        'birthdays': lambda: Person.objects.upcoming_birthdays(user, days=14, limit=4,
+            today=today),
+        'orbits': lambda: user_cache(user, ('orbits', today),
+            lambda: count_orbits(Person.objects.for_user(user))),
+    }
+    if chart is not None and DASHBOARD_INLINE_CHART:
+        parts['chart_data'] = lambda: trend(user, *chart)
+    return run_all(parts)
@@ -0,0 +1,76 @@
+"""SQLite tuning and a router sending page reads to their own connection.
+
+With several worker processes on one SQLite file, reads wait whenever a
+writer holds the lock unless the file is in WAL mode. `configure_sqlite` runs
+each alias' PRAGMAS (a key of its DATABASES entry) on every new connection.
+
+`ReadRouter` and `ReadDatabaseMiddleware` send the queries of the GET views in
+READ_VIEWS to the READ_DATABASE alias, a second, query-only connection to the
+same file. Writes always go to `default`. Both connections see the same file,
+so a page loaded after a redirect already shows what was just saved.
+"""
+import threading
+
+from django.conf import settings
+
+READ_DATABASE = getattr(settings, 'READ_DATABASE', 'read')
+
+# URL names of the views whose GETs only read
+READ_VIEWS = getattr(settings, 'READ_VIEWS', (
+    'home', 'person_list', 'person_detail', 'conversation_list', 'conversation_detail',
+    'company_list', 'sector_list', 'search', 'person_api', 'person_connections', 'birthday_api',
+    'trend_api',
+))
+
+_state = threading.local()
+
+def configure_sqlite(sender, connection, **kwargs):
+    """Run the alias' PRAGMAS on a new SQLite connection; connected to connection_created."""
+    if connection.vendor != 'sqlite':
+        return
+    pragmas = connection.settings_dict.get('PRAGMAS', {})
+    if pragmas:
+        with connection.cursor() as cursor:
+            for name, value in pragmas.items():
+                cursor.execute('PRAGMA {0} = {1}'.format(name, value))
+
+def get_reading():
+    """Whether this thread reads from READ_DATABASE, to hand on to worker threads."""
+    return getattr(_state, 'reading', False)
+
+def set_reading(reading):
+    _state.reading = reading and READ_DATABASE in settings.DATABASES
+
+class ReadRouter(object):
+    """Route reads to READ_DATABASE while the middleware says so, and everything else to default."""
+    def db_for_read(self, model, **hints):
+        return READ_DATABASE if get_reading() else 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Both aliases are the same database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+class ReadDatabaseMiddleware(object):
+    """Read from READ_DATABASE while answering GETs of READ_VIEWS, templates included.
+
+    Goes after the session and message middleware, whose writes happen on the
+    way out and must reach the default database.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        try:
+            return self.get_response(request)
+        finally:
+            set_reading(False)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method in ('GET', 'HEAD') and request.resolver_match.url_name in READ_VIEWS:
+            set_reading(True)
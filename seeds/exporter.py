@@ -0,0 +1,156 @@
+"""Streaming export of a user's data as CSV or JSON.
+
+Each kind of record is read with `.iterator()` in chunks, and the many-to-many
+relations (sectors, participants) are fetched with one query per chunk, so
+memory stays flat however many rows there are. CSV columns match the ones
+`seeds.importer` reads, so an export can be imported again.
+"""
+import csv
+import json
+from itertools import islice
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import ExpressionWrapper, F, IntegerField
+
+from .importer import SEPARATOR
+from .models import Person, Company, Sector, Conversation
+
+KINDS = ('people', 'conversations', 'companies', 'sectors')
+FORMATS = ('csv', 'json')
+
+COLUMNS = {
+    'people': ['first_name', 'last_name', 'company', 'sectors', 'city', 'birthday', 'address',
+        'notes', 'partner', 'known_via'],
+    'conversations': ['date', 'people', 'mode', 'summary', 'seed', 'location', 'notes'],
+    'companies': ['name'],
+    'sectors': ['name'],
+}
+
+def _chunks(qs, chunk_size):
+    rows = qs.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def _full_name(first_name, last_name):
+    """The name the importer matches people on."""
+    if first_name is None and last_name is None:
+        return None
+    return (first_name + ' ' + last_name).strip()
+
+def people(user, chunk_size=500):
+    """Yield chunks of people records, with their sectors."""
+    qs = (Person.objects.for_user(user)
+        .order_by('pk')
+        .values_list('pk', 'first_name', 'last_name', 'company__name', 'city', 'birthday',
+            'address', 'notes', 'partner__active', 'partner__first_name', 'partner__last_name',
+            'known_via__active', 'known_via__first_name', 'known_via__last_name'))
+    for chunk in _chunks(qs, chunk_size):
+        sectors = {}
+        for person_id, name in (Person.sectors.through.objects
+                .filter(person_id__in=[row[0] for row in chunk], sector__active=True)
+                .order_by('sector__name')
+                .values_list('person_id', 'sector__name')):
+            sectors.setdefault(person_id, []).append(name)
+
+        yield [{
+            'first_name': first_name,
+            'last_name': last_name,
+            'company': company,
+            'sectors': sectors.get(pk, []),
+            'city': city,
+            'birthday': birthday,
+            'address': address,
+            'notes': notes,
+            'partner': _full_name(partner_first, partner_last) if partner_active else None,
+            'known_via': _full_name(via_first, via_last) if via_active else None,
+        } for (pk, first_name, last_name, company, city, birthday, address, notes, partner_active,
+            partner_first, partner_last, via_active, via_first, via_last) in chunk]
+
+def conversations(user, chunk_size=500):
+    """Yield chunks of conversation records, with their participants.
+
+    Deleted people are left out of the participants, as the importer could
+    not find them again.
+    """
+    # Plain integer ids: making a Hashid for every row would dominate the export
+    qs = (Conversation.objects.for_user(user)
+        .annotate(seq=ExpressionWrapper(F('id'), IntegerField()))
+        .order_by('seq')
+        .values_list('seq', 'date', 'mode', 'summary', 'seed', 'location', 'notes'))
+    for chunk in _chunks(qs, chunk_size):
+        participants = {}
+        for conversation_id, first_name, last_name in (Conversation.people.through.objects
+                .annotate(seq=ExpressionWrapper(F('conversation_id'), IntegerField()))
+                .filter(seq__in=[row[0] for row in chunk], person__active=True)
+                .order_by('person__first_name', 'person__last_name')
+                .values_list('seq', 'person__first_name', 'person__last_name')):
+            participants.setdefault(conversation_id, []).append(_full_name(first_name, last_name))
+
+        yield [{
+            'date': date,
+            'people': participants.get(pk, []),
+            'mode': mode,
+            'summary': summary,
+            'seed': seed,
+            'location': location,
+            'notes': notes,
+        } for pk, date, mode, summary, seed, location, notes in chunk]
+
+def _names(model):
+    def records(user, chunk_size=500):
+        qs = model.objects.for_user(user).order_by('name').values_list('name', flat=True)
+        for chunk in _chunks(qs, chunk_size):
+            yield [{'name': name} for name in chunk]
+    return records
+
+RECORDS = {
+    'people': people,
+    'conversations': conversations,
+    'companies': _names(Company),
+    'sectors': _names(Sector),
+}
+
+class Echo(object):
+    """File-like object handing back what is written, for csv.writer."""
+    def write(self, value):
+        return value
+
+def to_csv(kind, chunks):
+    """Yield the CSV text for each chunk of records, after a header row."""
+    columns = COLUMNS[kind]
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for chunk in chunks:
+        yield ''.join(writer.writerow([
+            SEPARATOR.join(value) if isinstance(value, list) else value
+            for value in (record[column] for column in columns)
+        ]) for record in chunk)
+
+def to_json(chunks):
+    """Yield a JSON array piece by piece."""
+    yield '['
+    separator = ''
+    for chunk in chunks:
+        if chunk:
+            yield separator + ', '.join(json.dumps(record, cls=DjangoJSONEncoder) for record in chunk)
+            separator = ', '
+    yield ']'
+
+def export(user, kind, fmt, chunk_size=500):
+    """Yield the export as text in the format `fmt`. The 'all' kind is a JSON object with every kind."""
+    if kind == 'all':
+        assert fmt == 'json', 'Only JSON exports can hold every kind of record'
+        for i, each in enumerate(KINDS):
+            yield '{0}{1}: '.format('{' if i == 0 else ', ', json.dumps(each))
+            for text in to_json(RECORDS[each](user, chunk_size)):
+                yield text
+        yield '}'
+    elif fmt == 'csv':
+        for text in to_csv(kind, RECORDS[kind](user, chunk_size)):
+            yield text
+    else:
+        for text in to_json(RECORDS[kind](user, chunk_size)):
+            yield text
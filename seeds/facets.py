@@ -0,0 +1,66 @@
+"""Filter facets (values with counts) for the list sidebars.
+
+Each facet is counted with one GROUP BY over the list's queryset with every
+other active filter applied, so the counts show what selecting a value would
+return. Results are cached per user until any of the user's data changes.
+"""
+from django.db.models import Count
+
+from .models import Person, Conversation
+from .utils import user_cache
+
+CACHE_TIMEOUT = 60 * 60
+
+def _count(qs, value, name, limit=None):
+    """Return [{'value', 'name', 'count'}] for each distinct `value` in `qs`, most common first."""
+    rows = (qs
+        .order_by()
+        .values(value, name)
+        .annotate(count=Count('pk', distinct=True))
+        .order_by('-count', name))
+    if limit:
+        rows = rows[:limit]
+    return [{'value': row[value], 'name': row[name], 'count': row['count']} for row in rows]
+
+def person_facets(user, filtered, key):
+    """Sector, company and city facets for the people list.
+
+    `filtered(skip)` should return the user's people with every filter except
+    `skip` applied; `key` identifies the applied filters.
+    """
+    def compute():
+        return {
+            'sectors': _count(filtered('sector').filter(sectors__active=True),
+                'sectors__slug', 'sectors__name'),
+            'companies': _count(filtered('company').filter(company__active=True),
+                'company__slug', 'company__name'),
+            'cities': _count(filtered('city').exclude(city=''), 'city', 'city'),
+        }
+    return user_cache(user, ('person-facets',) + tuple(key), compute, CACHE_TIMEOUT)
+
+def conversation_facets(user, filtered, key, max_people=50, person=None):
+    """Sector, mode and person facets for the conversation list.
+
+    Arguments are as for person_facets; only the `max_people` people with the
+    most matching conversations are listed, and the selected `person`.
+    """
+    def compute():
+        modes = dict(Conversation.MODES)
+        # Person.name may follow relations, so look names up for the listed people only
+        people = _count(filtered('person').filter(people__active=True),
+            'people__pk', 'people__slug', limit=max_people)
+        if person is not None and person.pk not in [row['value'] for row in people]:
+            people.append({'value': person.pk, 'name': person.slug,
+                'count': filtered('person').filter(people=person).distinct().count()})
+        names = {p.pk: p.name for p in Person.objects
+            .filter(pk__in=[row['value'] for row in people])
+            .select_related('partner', 'known_via', 'company')}
+        return {
+            'sectors': _count(filtered('sector').filter(people__sectors__active=True),
+                'people__sectors__slug', 'people__sectors__name'),
+            'modes': [dict(row, name=modes.get(row['value'], row['value']))
+                for row in _count(filtered('mode'), 'mode', 'mode')],
+            'people': [{'value': row['name'], 'name': names.get(row['value'], row['name']),
+                'count': row['count']} for row in people],
+        }
+    return user_cache(user, ('conversation-facets',) + tuple(key), compute, CACHE_TIMEOUT)
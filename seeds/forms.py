@@ -1,7 +1,6 @@
 """All forms live here."""
 from django import forms
 from django.utils import timezone
-from django.db.models import Count
 from datetime import timedelta
 
 from crispy_forms.bootstrap import Tab, TabHolder
@@ -9,6 +8,8 @@ from crispy_forms.helper import FormHelper
 from crispy_forms.layout import Layout, Submit, HTML, Field, Row, Div, Hidden
 
 from .models import Person, Conversation, Sector, Company
+from .importer import guess_format
+from .widgets import PersonSelect, PersonSelectMultiple
 
 class PersonForm(forms.ModelForm):
     """Form for a person."""
@@ -69,18 +70,25 @@ class PersonForm(forms.ModelForm):
         # Remove "Delete" button
         if not self.instance.pk:
             self.helper.layout.fields[1].pop()
-            self.fields['sectors'].initial = [Sector.objects.filter(slug='friends').first()]
+            self.fields['sectors'].initial = [Sector.objects.for_user(user).filter(slug='friends').first()]
 
         # Adjust fields
         self.fields['sectors'].queryset = Sector.objects.for_user(user)
         self.fields['company'].queryset = Company.objects.for_user(user)
         self.fields['partner'].queryset = Person.objects.for_user(user).exclude(pk=self.instance.pk)
         self.fields['known_via'].queryset = Person.objects.for_user(user).exclude(pk=self.instance.pk)
+        if self.instance.pk:
+            self.fields['partner'].widget.attrs['data-exclude'] = self.instance.pk
+            self.fields['known_via'].widget.attrs['data-exclude'] = self.instance.pk
 
     class Meta:
         model = Person
         fields = ['first_name', 'last_name', 'partner', 'known_via', 'company', 'sectors', 'city', 
             'birthday', 'address', 'notes']
+        widgets = {
+            'partner': PersonSelect,
+            'known_via': PersonSelect,
+        }
 
 
 class ConversationForm(forms.ModelForm):
@@ -131,7 +139,7 @@ class ConversationForm(forms.ModelForm):
             self.helper.layout.fields[0][0].autofocus = ''
         
         # Adjust fields
-        self.fields['people'].queryset = Person.objects.for_user(user).annotate(num_conversations=Count('conversations')).order_by('-num_conversations', 'last_name', 'first_name')
+        self.fields['people'].queryset = Person.objects.for_user(user)
         self.fields['date'].initial = timezone.now().date() - timedelta(hours=6)
         self.fields['people'].label = ''
         self.fields['mode'].label = ''
@@ -164,6 +172,9 @@ class ConversationForm(forms.ModelForm):
     class Meta:
         model = Conversation
         fields = ['people', 'mode', 'summary', 'seed', 'date', 'location', 'notes']
+        widgets = {
+            'people': PersonSelectMultiple,
+        }
 
 class CompanyForm(forms.ModelForm):
     """Form for a company."""
@@ -196,3 +207,31 @@ class SectorForm(forms.ModelForm):
     class Meta:
         model = Sector
         fields = ['name']
+
+class ImportForm(forms.Form):
+    """Upload a file of people or conversations."""
+    KINDS = (
+        ('people', 'People'),
+        ('conversations', 'Conversations'),
+    )
+    kind = forms.ChoiceField(choices=KINDS, label='Import')
+    file = forms.FileField(help_text='A CSV file with a header row, or a vCard (.vcf) file of people.')
+
+    def __init__(self, *args, **kwargs):
+        super(ImportForm, self).__init__(*args, **kwargs)
+        self.helper = FormHelper()
+        self.helper.layout = Layout(
+            Field('kind'),
+            Field('file'),
+            Div(
+                Submit('submit', 'Import'),
+            ),
+        )
+
+    def clean(self):
+        cleaned_data = super(ImportForm, self).clean()
+        upload = cleaned_data.get('file')
+        if (upload and cleaned_data.get('kind') == 'conversations' and
+                guess_format(upload.name) == 'vcard'):
+            raise forms.ValidationError('vCard files can only be imported as people.')
+        return cleaned_data
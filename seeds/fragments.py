@@ -0,0 +1,19 @@
+"""Versions for the cached list items in templates.
+
+Each cached item is keyed on its object's id and `modified_on`, plus any stored
+field it shows that changes without a save (see the list-item templates). The
+per-user version covers the rest: names shown in other people's rows, which
+come from partners, "known via" and companies. It is kept in the database
+(DataVersion.fragments), so items cached by any process are dropped together.
+"""
+from django.utils import timezone
+
+from .utils import bump_counter, get_counter
+
+def invalidate(user_id):
+    """Drop every cached list item for the user, once the current transaction commits."""
+    bump_counter(user_id, 'fragments')
+
+def version(user):
+    """The user's current version, which also changes daily as items show dates relative to today."""
+    return '{0}-{1}'.format(get_counter(user.pk, 'fragments'), timezone.now().date().isoformat())
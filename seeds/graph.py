@@ -0,0 +1,158 @@
+"""In-memory graph of how a user's people know each other, for introduction paths.
+
+People are linked when one is known via the other, when they are partners, and
+when they took part in the same conversation. Node 0 stands for the user, who
+is linked to everyone they had a conversation with (seeds, being unanswered,
+do not count). Links are kept in compressed sparse rows: the neighbors of node
+i are `targets[offsets[i]:offsets[i + 1]]`, with how they are linked in
+`kinds`. Paths and neighborhoods are breadth-first searches over the arrays.
+"""
+from array import array
+from collections import deque
+
+from django.conf import settings
+from django.db.models import ExpressionWrapper, F, IntegerField
+
+from .models import Person, Conversation
+from .utils import UserObjects
+
+# How two nodes are linked, as bits of `kinds`
+KNOWN_VIA, PARTNER, CONVERSATION = 1, 2, 4
+KIND_NAMES = ((KNOWN_VIA, 'known via'), (PARTNER, 'partner'), (CONVERSATION, 'conversation'))
+
+YOU = 0
+
+# Number of users whose graph each process keeps
+GRAPH_CACHE_SIZE = getattr(settings, 'GRAPH_CACHE_SIZE', 50)
+
+def _full_name(first_name, last_name):
+    return (first_name + ' ' + last_name).strip()
+
+class PersonGraph(object):
+    """One user's people and the links between them."""
+    def __init__(self, people, links):
+        """`people` are dicts of name, slug and pk; `links` is {(pk, pk): kind bits}, with None for the user."""
+        self.people = [None] + list(people)
+        self.nodes = {person['pk']: i for i, person in enumerate(self.people) if i}
+        self.nodes[None] = YOU
+
+        neighbors = [[] for _ in self.people]
+        for (a, b), kind in links.items():
+            a, b = self.nodes.get(a), self.nodes.get(b)
+            if a is not None and b is not None and a != b:
+                neighbors[a].append((b, kind))
+                neighbors[b].append((a, kind))
+
+        self.offsets = array('l', [0])
+        self.targets = array('l')
+        self.kinds = array('b')
+        for node_neighbors in neighbors:
+            for target, kind in sorted(node_neighbors):
+                self.targets.append(target)
+                self.kinds.append(kind)
+            self.offsets.append(len(self.targets))
+
+    @classmethod
+    def build(cls, user):
+        """The graph of the user's active people, from two queries."""
+        # Plain values: making thousands of Person objects would dominate the build
+        rows = list(Person.objects.for_user(user)
+            .order_by('pk')
+            .values_list('pk', 'slug', 'first_name', 'last_name', 'partner_id', 'known_via_id',
+                'company__name'))
+        names = {row[0]: _full_name(row[2], row[3]) for row in rows}
+        links = {}
+        def link(a, b, kind):
+            key = (a, b) if (a or 0) < (b or 0) else (b, a)
+            links[key] = links.get(key, 0) | kind
+
+        people = []
+        for pk, slug, first_name, last_name, partner_id, known_via_id, company in rows:
+            if known_via_id:
+                link(pk, known_via_id, KNOWN_VIA)
+            if partner_id:
+                link(pk, partner_id, PARTNER)
+            # As Person.name does
+            name = names[pk] if last_name else '{0} ({1})'.format(first_name,
+                names.get(partner_id) or names.get(known_via_id) or company or '?')
+            people.append({'name': name, 'slug': slug, 'pk': pk})
+
+        # Plain integer ids to group by; see exporter.conversations
+        participations = (Conversation.people.through.objects
+            .filter(conversation__created_by=user, conversation__active=True,
+                conversation__seed=False)
+            .annotate(seq=ExpressionWrapper(F('conversation_id'), IntegerField()))
+            .order_by('seq')
+            .values_list('seq', 'person_id'))
+        current, group = None, []
+        for seq, person_id in participations.iterator():
+            if seq != current:
+                current, group = seq, []
+            link(None, person_id, CONVERSATION)
+            for other in group:
+                link(other, person_id, CONVERSATION)
+            group.append(person_id)
+        return cls(people, links)
+
+    def neighbors(self, node):
+        start, end = self.offsets[node], self.offsets[node + 1]
+        return zip(self.targets[start:end], self.kinds[start:end])
+
+    def _search(self, start, max_hops=None, through_you=True, stop=None):
+        """Breadth-first search; return {node: (previous node, kind, distance)}."""
+        seen = {start: (None, 0, 0)}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            if node == stop:
+                break
+            distance = seen[node][2] + 1
+            if max_hops is not None and distance > max_hops:
+                continue
+            for target, kind in self.neighbors(node):
+                if target not in seen and (through_you or target != YOU):
+                    seen[target] = (node, kind, distance)
+                    queue.append(target)
+        return seen
+
+    def describe(self, node, kind, **extra):
+        """A node as JSON, with the names of the links that lead to it."""
+        data = {'name': 'You', 'id': None} if node == YOU else {
+            'name': self.people[node]['name'], 'id': self.people[node]['slug']}
+        data['via'] = [name for bit, name in KIND_NAMES if kind & bit]
+        data.update(extra)
+        return data
+
+    def path(self, pk):
+        """The shortest chain of links from the user to the person, or None if there is none."""
+        target = self.nodes.get(pk)
+        if target is None or target == YOU:
+            return None
+        seen = self._search(YOU, stop=target)
+        if target not in seen:
+            return None
+        steps = []
+        node = target
+        while node is not None:
+            previous, kind, _ = seen[node]
+            steps.append(self.describe(node, kind))
+            node = previous
+        return steps[::-1]
+
+    def neighborhood(self, pk, hops=2):
+        """Everyone within `hops` links of the person, nearest first, leaving the user out."""
+        start = self.nodes.get(pk)
+        if start is None or start == YOU:
+            return []
+        seen = self._search(start, max_hops=hops, through_you=False)
+        nodes = sorted((distance, self.people[node]['name'], node, previous, kind)
+            for node, (previous, kind, distance) in seen.items() if node != start)
+        # `via` is how each person is linked to `through`, the one before them
+        return [self.describe(node, kind, distance=distance, through=self.people[previous]['slug'])
+            for distance, _, node, previous, kind in nodes]
+
+_graphs = UserObjects(PersonGraph.build, GRAPH_CACHE_SIZE)
+
+def get_graph(user):
+    """Return the user's graph, rebuilding it if the user's data changed since."""
+    return _graphs.get(user)
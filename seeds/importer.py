@@ -0,0 +1,377 @@
+"""Bulk import of people and conversations from CSV or vCard files.
+
+Rows are read lazily and handled in chunks: each chunk is validated, its
+companies, sectors and participants are looked up in maps built once per
+import, and everything is inserted with `bulk_create`. Partner and "known via"
+references may point at rows further down the file, so they are resolved after
+the last chunk, with one UPDATE per few hundred people.
+"""
+import csv
+import re
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.forms.models import fields_for_model
+
+from . import autocomplete, birthdays, fragments, search
+from .models import Person, Company, Sector, Conversation, ConversationRollup
+from .utils import assign_slugs, bump_generation
+
+FORMATS = (
+    ('csv', 'CSV'),
+    ('vcard', 'vCard'),
+)
+
+# Separates several sectors or people in one CSV cell
+SEPARATOR = ';'
+
+# Rows per UPDATE when linking people; keeps CASE expressions within SQLite's limits
+LINK_BATCH_SIZE = 400
+
+normalize = autocomplete.normalize
+
+# Form fields validating each row; shared, since building a form per row is slow
+PERSON_FIELDS = fields_for_model(Person,
+    fields=['first_name', 'last_name', 'city', 'birthday', 'address', 'notes'])
+CONVERSATION_FIELDS = fields_for_model(Conversation,
+    fields=['mode', 'summary', 'seed', 'date', 'location', 'notes'])
+
+def guess_format(filename):
+    return 'vcard' if filename.lower().endswith(('.vcf', '.vcard')) else 'csv'
+
+def read_csv(f):
+    """Yield (line number, row) pairs, with lowercased and underscored column names."""
+    reader = csv.reader(f)
+    header = ['_'.join(column.lower().split()) for column in next(reader, [])]
+    for cells in reader:
+        if any(cell.strip() for cell in cells):
+            yield reader.line_num, dict(zip(header, (cell.strip() for cell in cells)))
+
+def _unfold(f):
+    """Yield (line number, line) pairs, joining folded vCard lines."""
+    current, start = None, 0
+    for number, line in enumerate(f, 1):
+        line = line.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, number
+    if current is not None:
+        yield start, current
+
+def _unescape(value):
+    return re.sub(r'\\(.)', lambda m: '\n' if m.group(1) in 'nN' else m.group(1), value)
+
+def _split(value, separator=';'):
+    """Split a structured vCard value on unescaped separators."""
+    return [_unescape(part).strip() for part in re.split(r'(?<!\\)' + separator, value)]
+
+def _birthday(value):
+    """vCard birthdays are 19850412, 1985-04-12 or, without a year, --0412."""
+    digits = re.sub(r'\D', '', value.split('T')[0])
+    if value.startswith('--') and len(digits) == 4:
+        digits = '1900' + digits
+    if len(digits) == 8:
+        return '{0}-{1}-{2}'.format(digits[:4], digits[4:6], digits[6:])
+    return value
+
+def read_vcard(f):
+    """Yield (line number, row) pairs for each card, using the CSV column names."""
+    row, start = None, 0
+    for number, line in _unfold(f):
+        name, _, value = line.partition(':')
+        params = name.upper().split(';')
+        prop = params[0].split('.')[-1]
+        if prop == 'BEGIN' and value.upper() == 'VCARD':
+            row, start = {}, number
+        elif row is None:
+            continue
+        elif prop == 'END':
+            yield start, row
+            row = None
+        elif prop == 'N':
+            parts = _split(value) + ['', '']
+            row['last_name'], row['first_name'] = parts[0], parts[1]
+        elif prop == 'FN':
+            row['name'] = _unescape(value).strip()
+        elif prop == 'ORG':
+            row['company'] = _split(value)[0]
+        elif prop == 'BDAY':
+            row['birthday'] = _birthday(value)
+        elif prop == 'ADR':
+            # PO box; extended; street; city; region; postal code; country
+            parts = _split(value) + [''] * 7
+            row['city'] = parts[3]
+            row['address'] = ', '.join(part for part in parts[:7] if part)
+        elif prop == 'NOTE':
+            row['notes'] = _unescape(value)
+        elif prop == 'CATEGORIES':
+            row['sectors'] = SEPARATOR.join(_split(value, ','))
+        elif prop == 'X-SPOUSE' or (prop == 'RELATED' and
+                any(param in ('TYPE=SPOUSE', 'TYPE=PARTNER') for param in params)):
+            row['partner'] = _unescape(value).strip()
+
+def read(f, fmt):
+    """Yield (line number, row) pairs from a text file in the format `fmt`, one of `FORMATS`."""
+    return {'csv': read_csv, 'vcard': read_vcard}[fmt](f)
+
+def _split_names(value):
+    return [name.strip() for name in (value or '').split(SEPARATOR) if name.strip()]
+
+def bulk_insert(model, objs):
+    """`bulk_create` that also sets primary keys where the backend does not return them.
+
+    Must run inside a transaction: on SQLite the write lock taken by the insert
+    guarantees the new rows hold the highest ids, in insertion order.
+    """
+    model.objects.bulk_create(objs)
+    if objs and objs[0].pk is None:
+        pks = (model.objects.all_objects()
+            .order_by('-pk')
+            .values_list('pk', flat=True)[:len(objs)])
+        for obj, pk in zip(objs, reversed(list(pks))):
+            obj.pk = pk
+    return objs
+
+class Importer(object):
+    """Import rows, as (line number, dict) pairs, for one user.
+
+    Rows that cannot be imported (or whose links cannot be made) are recorded in
+    `errors` as (line number, message). If given, `progress` is called with the
+    number of rows read so far after each chunk.
+    """
+    def __init__(self, user, chunk_size=500, progress=None):
+        self.user = user
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.created = 0
+        self.errors = []
+        self._people = {}
+        self._cache = {}
+
+    def error(self, line, message):
+        self.errors.append((line, message))
+
+    def _chunks(self, rows):
+        rows = iter(rows)
+        count = 0
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk
+            count += len(chunk)
+            if self.progress:
+                self.progress(count)
+
+    def _clean(self, model, fields, line, row):
+        """Validate a row with form fields, returning an unsaved instance or None."""
+        values, valid = {}, True
+        for name, field in fields.items():
+            if name not in row and not field.required:
+                # Keep the model default
+                continue
+            try:
+                values[name] = field.clean(row.get(name))
+            except ValidationError as e:
+                self.error(line, '{0}: {1}'.format(name, ' '.join(e.messages)))
+                valid = False
+        if valid:
+            return model(created_by=self.user, **values)
+
+    def _load_people(self):
+        """Map each normalized full name to a pk, or to None if several people share it."""
+        self._people = {}
+        people = Person.objects.for_user(self.user).values_list('pk', 'first_name', 'last_name')
+        for pk, first_name, last_name in people.iterator():
+            self._add_person(pk, first_name, last_name)
+
+    def _add_person(self, pk, first_name, last_name):
+        key = normalize(first_name + ' ' + last_name)
+        self._people[key] = None if key in self._people else pk
+
+    def _find_person(self, name):
+        key = normalize(name)
+        if key not in self._people:
+            raise ValueError('No person named "{0}".'.format(name))
+        if self._people[key] is None:
+            raise ValueError('More than one person is named "{0}".'.format(name))
+        return self._people[key]
+
+    def _lookup(self, model, names):
+        """Return {normalized name: object}, creating missing objects in one insert."""
+        if model not in self._cache:
+            self._cache[model] = {normalize(obj.name): obj
+                for obj in model.objects.for_user(self.user)}
+        cache = self._cache[model]
+
+        missing = {}
+        for name in names:
+            key = normalize(name)
+            if key and key not in cache and key not in missing:
+                missing[key] = model(name=name, created_by=self.user)
+        if missing:
+            bulk_insert(model, assign_slugs(missing.values()))
+            cache.update(missing)
+        return cache
+
+    def _check_length(self, line, model, names):
+        max_length = model._meta.get_field('name').max_length
+        for name in names:
+            if len(name) > max_length:
+                self.error(line, '"{0}" is longer than {1} characters.'.format(name, max_length))
+                return False
+        return True
+
+    def import_people(self, rows):
+        """Create people with their companies and sectors, then link partners and "known via"."""
+        self._load_people()
+        links = []
+        for chunk in self._chunks(rows):
+            people = []
+            for line, row in chunk:
+                if not row.get('first_name') and not row.get('last_name') and row.get('name'):
+                    names = row['name'].rsplit(' ', 1)
+                    row['first_name'], row['last_name'] = names[0], names[1] if len(names) > 1 else ''
+                person = self._clean(Person, PERSON_FIELDS, line, row)
+                if person is None:
+                    continue
+                if not person.first_name and not person.last_name:
+                    self.error(line, 'A first or last name is required.')
+                    continue
+                # Person.save is skipped by bulk_create
+                person.birthday_key = birthdays.day_key(person.birthday)
+                company = row.get('company', '')
+                sectors = _split_names(row.get('sectors'))
+                if (self._check_length(line, Company, [company]) and
+                        self._check_length(line, Sector, sectors)):
+                    people.append((line, row, person, company, sectors))
+
+            with transaction.atomic():
+                companies = self._lookup(Company, [company for _, _, _, company, _ in people])
+                sectors = self._lookup(Sector, [name for _, _, _, _, names in people for name in names])
+                for _, _, person, company, _ in people:
+                    person.company = companies.get(normalize(company))
+                created = bulk_insert(Person, assign_slugs(person for _, _, person, _, _ in people))
+
+                through = Person.sectors.through
+                through.objects.bulk_create([
+                    through(person_id=person.pk, sector_id=sector_id)
+                    for _, _, person, _, names in people
+                    for sector_id in set(sectors[normalize(name)].pk for name in names)
+                ])
+                search.insert(created)
+
+            for line, row, person, _, _ in people:
+                self._add_person(person.pk, person.first_name, person.last_name)
+                for field in ('partner', 'known_via'):
+                    if row.get(field):
+                        links.append((line, person.pk, field, row[field]))
+            self.created += len(created)
+
+        self._link_people(links)
+        bump_generation(self.user.pk)
+        fragments.invalidate(self.user.pk)
+
+    def _link_people(self, links):
+        """Set partners (on both sides, as Person.save does) and "known via" in bulk."""
+        partners, known_via = {}, {}
+        for line, pk, field, name in links:
+            try:
+                other = self._find_person(name)
+            except ValueError as e:
+                self.error(line, str(e))
+                continue
+            if other == pk:
+                self.error(line, 'A person cannot be linked to themselves.')
+            elif field == 'known_via':
+                known_via[pk] = other
+            elif partners.get(pk, other) != other or partners.get(other, pk) != pk:
+                self.error(line, 'Partner "{0}" conflicts with another row.'.format(name))
+            else:
+                partners[pk], partners[other] = other, pk
+
+        people = Person.objects.all_objects()
+        renamed = set()
+        with transaction.atomic():
+            pks = list(partners)
+            for i in range(0, len(pks), LINK_BATCH_SIZE):
+                # Whoever these people were partnered with before is left single
+                batch = pks[i:i + LINK_BATCH_SIZE]
+                unlinked = people.filter(Q(pk__in=batch) | Q(partner__in=batch))
+                # People without a last name are shown with their partner's name
+                renamed.update(unlinked.filter(last_name='').values_list('pk', flat=True))
+                unlinked.update(partner=None)
+
+            for field, values in (('partner', partners), ('known_via', known_via)):
+                items = list(values.items())
+                for i in range(0, len(items), LINK_BATCH_SIZE):
+                    batch = items[i:i + LINK_BATCH_SIZE]
+                    people.filter(pk__in=[pk for pk, _ in batch]).update(**{field: Case(
+                        *[When(pk=pk, then=Value(other)) for pk, other in batch],
+                        output_field=IntegerField())})
+
+            if renamed:
+                Conversation.objects.update_people_str(Conversation.people.through.objects
+                    .filter(person__in=renamed).values('conversation'))
+
+    def import_conversations(self, rows):
+        """Create conversations, finding their participants by name."""
+        self._load_people()
+        modes = {}
+        for value, label in Conversation.MODES:
+            if value:
+                modes[normalize(value)] = modes[normalize(label)] = value
+
+        for chunk in self._chunks(rows):
+            conversations = []
+            for line, row in chunk:
+                row['mode'] = modes.get(normalize(row.get('mode')), row.get('mode'))
+                row['seed'] = normalize(row.get('seed')) in ('1', 'true', 'yes', 'y', 'x')
+                conversation = self._clean(Conversation, CONVERSATION_FIELDS, line, row)
+                if conversation is None:
+                    continue
+                try:
+                    people = [self._find_person(name) for name in _split_names(row.get('people'))]
+                except ValueError as e:
+                    self.error(line, str(e))
+                    continue
+                if not people:
+                    self.error(line, 'No people listed.')
+                elif conversation.seed and conversation.mode in ['one on one', 'in group', 'skype', 'phone']:
+                    self.error(line, 'How can the conversation be unreciprocated if it was {0}?'.format(
+                        conversation.mode))
+                elif conversation.mode == 'one on one' and len(set(people)) > 1:
+                    self.error(line, 'A conversation with more than one person cannot be one on one.')
+                else:
+                    conversations.append((conversation, people))
+
+            participants = (Person.objects.select_related('partner', 'known_via', 'company')
+                .in_bulk(list({pk for _, people in conversations for pk in people})))
+            for conversation, people in conversations:
+                people = sorted((participants[pk] for pk in set(people) if pk in participants),
+                    key=lambda person: (person.first_name, person.last_name))
+                conversation.people_str = Conversation.describe_people(people)
+                conversation.num_people = len(people)
+
+            with transaction.atomic():
+                created = bulk_insert(Conversation, [conversation for conversation, _ in conversations])
+                through = Conversation.people.through
+                through.objects.bulk_create([
+                    through(conversation_id=conversation.pk, person_id=pk)
+                    for conversation, people in conversations
+                    for pk in set(people)
+                ])
+                search.insert(created)
+            self.created += len(created)
+
+        Person.objects.update_contact_stats(Person.objects.for_user(self.user))
+        ConversationRollup.objects.rebuild(self.user)
+        bump_generation(self.user.pk)
+
+    def run(self, kind, rows):
+        return {'people': self.import_people, 'conversations': self.import_conversations}[kind](rows)
@@ -0,0 +1,41 @@
+"""Shared base for the commands that rebuild stored data."""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from seeds.utils import bump_generation
+
+class RebuildCommand(BaseCommand):
+    """Rebuild stored data for every user, or only the one named with --user.
+
+    Subclasses implement rebuild(user), which gets None for every user and
+    returns the count to fill into `done`.
+    """
+    done = 'Rebuilt {0} objects.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Only rebuild for this username.')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError('No user named "{0}"'.format(options['user']))
+        count = self.rebuild(user)
+        self.stdout.write(self.style.SUCCESS(self.done.format(count)))
+
+    def rebuild(self, user):
+        """Rebuild the data of `user`, or of everyone if None, and return how many objects changed."""
+        raise NotImplementedError
+
+    @staticmethod
+    def owned(queryset, user):
+        """`queryset` limited to the objects of `user`, if one was given."""
+        return queryset.filter(created_by=user) if user else queryset
+
+    @staticmethod
+    def changed(queryset):
+        """Invalidate the cached pages of everyone owning an object in `queryset`."""
+        for user_id in queryset.order_by().values_list('created_by', flat=True).distinct():
+            bump_generation(user_id)
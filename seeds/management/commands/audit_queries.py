@@ -0,0 +1,164 @@
+"""Check the query plans behind every page."""
+import re
+from contextlib import ExitStack
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from seeds import search
+from seeds.models import Person, Company, Sector, Conversation
+
+# A step reading a whole table without any index
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+( AS \w+)?$')
+# Sorting every matching row; under a LIMIT that means reading far more than a page.
+# Partial sorts ("RIGHT PART OF ORDER BY") stop early and aren't flagged.
+FULL_SORT = re.compile(r'^USE TEMP B-TREE FOR ORDER BY$')
+
+# Tables outside the app
+IGNORED_TABLES = ('django_session', 'auth_user')
+
+# ORDER BY clauses known to need a sort
+ALLOWED_SORTS = (
+    # Dashboard "pings": the strongest relationships last seen between 3 years and a quarter ago.
+    # The range and the ranking are on different columns, so the range is read and sorted.
+    # (The people list sorted by level goes on to last_name, and uses person_level_idx.)
+    'ORDER BY "seeds_person"."level" DESC ',
+)
+
+def get_pages(user):
+    """URLs of the pages and APIs to audit, with the filters each list supports."""
+    people = Person.objects.for_user(user)
+    person = people.first()
+    conversation = Conversation.objects.for_user(user).first()
+    sector = Sector.objects.for_user(user).first()
+    company = Company.objects.for_user(user).first()
+
+    pages = [
+        reverse('home'),
+        reverse('person_list'),
+        reverse('person_list') + '?date=month',
+        reverse('person_list') + '?order=level',
+        reverse('conversation_list'),
+        reverse('conversation_list') + '?mode=email',
+        reverse('conversation_list') + '?seeds=true',
+        reverse('conversation_list') + '?date=month',
+        reverse('company_list'),
+        reverse('sector_list'),
+        reverse('search') + '?q=a',
+        reverse('person_api') + '?q=a',
+        reverse('birthday_api'),
+        reverse('birthday_api') + '?days=60',
+        reverse('trend_api') + '?period=week',
+        reverse('trend_api') + '?period=day',
+        reverse('person_create'),
+        reverse('conversation_create'),
+    ]
+    if person:
+        pages += [
+            reverse('person_detail', kwargs={'slug': person.slug}),
+            reverse('person_update', kwargs={'slug': person.slug}),
+            reverse('person_connections', kwargs={'slug': person.slug}),
+            reverse('conversation_list') + '?person=' + person.slug,
+            reverse('search') + '?q=a&person=' + person.slug,
+        ]
+        if person.city:
+            pages.append(reverse('person_list') + '?city=' + person.city)
+    if conversation:
+        pages += [
+            reverse('conversation_detail', kwargs={'pk': conversation.pk}),
+            reverse('conversation_update', kwargs={'pk': conversation.pk}),
+        ]
+    if sector:
+        pages += [
+            reverse('person_list') + '?sector=' + sector.slug,
+            reverse('conversation_list') + '?sector=' + sector.slug,
+        ]
+    if company:
+        pages.append(reverse('person_list') + '?company=' + company.slug)
+    return pages
+
+def explain(sql):
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+        return [row[-1] for row in cursor.fetchall()]
+
+def problems(sql, plan):
+    """Plan steps that scan a whole table, or sort all of a user's rows to return a page.
+
+    Sorting aggregates (top facets) or rows reached through one object (a person's
+    conversations) is expected: no index can order the first, and the second is small.
+    """
+    if search.TABLE in sql:
+        # Full-text results are ranked by bm25, which no index can provide
+        return []
+    per_user_page = (re.search(r'\bLIMIT \d+', sql) and 'GROUP BY' not in sql and
+        plan and 'created_by_id=' in plan[0] and not any(order in sql for order in ALLOWED_SORTS))
+    return [step for step in plan
+        if (FULL_SCAN.match(step) and not any(table in step for table in IGNORED_TABLES)) or
+        (per_user_page and FULL_SORT.match(step))]
+
+class Command(BaseCommand):
+    """Explain the queries behind every page and report plans that scan or sort whole tables."""
+    help = ('Load every page as a user, run EXPLAIN QUERY PLAN on each SELECT it makes, '
+        'and fail if a plan scans a whole table or sorts every row to return a page.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help='Username to load the pages as; defaults to the first user.')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan, not only problems.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('The audit reads SQLite query plans.')
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError('No user named "{0}"'.format(options['user']))
+        else:
+            user = User.objects.order_by('pk').first()
+            if user is None:
+                raise CommandError('There are no users to audit with.')
+
+        client = Client()
+        client.force_login(user)
+        # Queries run by worker threads would not be captured; see seeds/dashboard.py
+        with override_settings(DASHBOARD_WORKERS=0):
+            flagged = self.audit(client, get_pages(user), options['verbose_plans'])
+
+        if flagged:
+            raise CommandError('{0} problems found in query plans.'.format(flagged))
+        self.stdout.write(self.style.SUCCESS('All query plans use indexes.'))
+
+    def audit(self, client, urls, verbose_plans):
+        """Print the problems in the query plans of each URL, and return how many there are."""
+        flagged = 0
+        for url in urls:
+            # Pages may read through another alias; see seeds/database.py
+            with ExitStack() as stack:
+                captures = [stack.enter_context(CaptureQueriesContext(connections[alias]))
+                    for alias in connections]
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            if response.status_code != 200:
+                self.stderr.write('{0}: status {1}'.format(url, response.status_code))
+                flagged += 1
+                continue
+
+            seen = set()
+            for query in (query for capture in captures for query in capture.captured_queries):
+                sql = query['sql']
+                if not sql.startswith('SELECT') or sql in seen:
+                    continue
+                seen.add(sql)
+                plan = explain(sql)
+                bad = problems(sql, plan)
+                if bad or verbose_plans:
+                    self.stdout.write('\n{0}\n  {1}'.format(url, sql))
+                    for step in plan:
+                        self.stdout.write('    {0}{1}'.format('!! ' if step in bad else '', step))
+                flagged += len(bad)
+        return flagged
@@ -0,0 +1,212 @@
+"""Time every page at several account sizes."""
+import json
+import math
+import statistics
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import URLPattern, reverse
+
+from seeds import sampledata, urls
+from seeds.metrics import QueryTimer, timing
+from seeds.models import Person, Company, Sector, Conversation
+
+DEFAULT_SCALES = '100x500,400x2000,1600x8000'
+
+# Differences in load time smaller than this are noise, whatever the ratio
+NOISE_MS = 2
+
+# Actions posted from other pages, with nothing to GET, and the staff-only metrics
+SKIPPED = ('sector_delete', 'company_delete', 'metrics')
+
+# Extra variants of pages that take filters, by URL name
+QUERIES = {
+    'person_list': ['', '?date=month', '?city=Chicago'],
+    'conversation_list': ['', '?mode=email', '?seeds=true', '?date=year'],
+    'search': ['?q=coffee'],
+    'person_api': ['?q=an'],
+    'person_connections': ['', '?hops=3'],
+    'birthday_api': ['', '?days=60'],
+    'trend_api': ['?period=week', '?period=day'],
+}
+
+def parse_scales(value):
+    """'100x500,400x2000' -> [(100, 500), (400, 2000)], smallest first."""
+    try:
+        scales = [tuple(int(n) for n in scale.split('x')) for scale in value.split(',')]
+    except ValueError:
+        scales = None
+    if not scales or any(len(scale) != 2 for scale in scales):
+        raise CommandError('Scales look like 100x500,400x2000 (people x conversations).')
+    return sorted(scales, key=lambda scale: scale[1])
+
+def get_pages(user):
+    """(label, URL) for each named page in seeds/urls.py, filled in with the user's objects."""
+    objects = {
+        'person': Person.objects.for_user(user).order_by('-level').first(),
+        'sector': Sector.objects.for_user(user).first(),
+        'company': Company.objects.for_user(user).first(),
+        'conversation': Conversation.objects.for_user(user).order_by('-date').first(),
+    }
+    pages = []
+    for pattern in urls.urlpatterns:
+        if not isinstance(pattern, URLPattern) or not pattern.name or pattern.name in SKIPPED:
+            continue
+        name = pattern.name
+        groups = pattern.pattern.regex.groupindex
+        if 'kind' in groups:
+            kwargs_list = [{'kind': 'people', 'fmt': 'csv'},
+                {'kind': 'conversations', 'fmt': 'json'}]
+        elif groups:
+            obj = objects[name.split('_')[0]]
+            kwargs_list = [{key: getattr(obj, key) for key in groups}] if obj else []
+        else:
+            kwargs_list = [{}]
+
+        for kwargs in kwargs_list:
+            url = reverse(name, kwargs=kwargs)
+            label = name + ('.' + '.'.join(kwargs.get(key) for key in ('kind', 'fmt'))
+                if 'kind' in kwargs else '')
+            for query in QUERIES.get(name, ['']):
+                pages.append((label + query, url + query))
+    return pages
+
+def measure(client, url, repeat):
+    """Median wall time and SQL time in ms, and the query count, of loading a URL."""
+    walls, sql_times = [], []
+    for i in range(repeat + 1):
+        timer = QueryTimer()
+        with timing(timer):
+            start = perf_counter()
+            response = client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            wall = perf_counter() - start
+        if response.status_code >= 400:
+            raise CommandError('{0}: status {1}'.format(url, response.status_code))
+        if i:
+            # The first load only warms caches
+            walls.append(wall * 1000)
+            sql_times.append(timer.time * 1000)
+    return {
+        'ms': round(statistics.median(walls), 2),
+        'queries': timer.count,
+        'sql_ms': round(statistics.median(sql_times), 2),
+    }
+
+def growth(small, large, small_size, large_size):
+    """How time grows with account size: t ~ size ** exponent."""
+    if small <= 0 or large <= 0 or large_size == small_size:
+        return 0
+    return math.log(large / small) / math.log(large_size / small_size)
+
+class Command(BaseCommand):
+    """Time every page at several account sizes and compare with a saved baseline."""
+    help = ('Generate an account at each scale (people x conversations), load every page '
+        'of seeds/urls.py as its user, and report wall time, query count and SQL time. '
+        'Pages whose time grows faster than the data are flagged, and results can be '
+        'saved to and compared against a baseline JSON file.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default=DEFAULT_SCALES,
+            help='Comma-separated people x conversations; default {0}.'.format(DEFAULT_SCALES))
+        parser.add_argument('--repeat', type=int, default=5, help='Timed loads per page.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--regenerate', action='store_true',
+            help='Refill the benchmark accounts even if they already hold the right data.')
+        parser.add_argument('--save', metavar='PATH', help='Write the results as JSON.')
+        parser.add_argument('--baseline', metavar='PATH', help='Compare with saved results.')
+        parser.add_argument('--tolerance', type=float, default=1.25,
+            help='Slowdown over the baseline that counts as a regression; default 1.25.')
+        parser.add_argument('--max-exponent', type=float, default=1.0,
+            help='Flag pages whose time grows faster than size ** this; default 1.0.')
+
+    def handle(self, *args, **options):
+        scales = parse_scales(options['scales'])
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)['results']
+
+        results = {}
+        for people, conversations in scales:
+            user = self.get_user(people, conversations, options)
+            client = Client()
+            client.force_login(user)
+            scale = '{0}x{1}'.format(people, conversations)
+            results[scale] = {}
+            for label, url in get_pages(user):
+                results[scale][label] = measure(client, url, options['repeat'])
+            self.stdout.write('Measured {0} pages at {1}'.format(len(results[scale]), scale))
+
+        self.report(scales, results)
+        failures = self.compare(results, baseline, options['tolerance']) if baseline else 0
+        failures += self.check_growth(scales, results, options['max_exponent'])
+
+        if options['save']:
+            with open(options['save'], 'w') as f:
+                json.dump({'scales': list(results), 'results': results}, f, indent=2, sort_keys=True)
+            self.stdout.write('Saved results to {0}'.format(options['save']))
+        if failures:
+            raise CommandError('{0} problems: pages slower than the baseline or growing super-linearly.'.format(failures))
+        self.stdout.write(self.style.SUCCESS('No regressions.'))
+
+    def get_user(self, people, conversations, options):
+        """The account for a scale, generated unless it already holds that much data."""
+        username = 'bench-{0}x{1}'.format(people, conversations)
+        user = User.objects.filter(username=username).first()
+        if (options['regenerate'] or user is None or
+                Person.objects.for_user(user).count() != people or
+                Conversation.objects.for_user(user).count() != conversations):
+            self.stdout.write('Generating {0}...'.format(username))
+            user, errors = sampledata.generate(username, people, conversations, seed=options['seed'])
+            if errors:
+                raise CommandError('Could not generate {0}: line {1}: {2}'.format(username, *errors[0]))
+        return user
+
+    def report(self, scales, results):
+        labels = ['{0}x{1}'.format(*scale) for scale in scales]
+        width = max(len(page) for page in results[labels[0]])
+        self.stdout.write('\n{0}  {1}'.format('page'.ljust(width),
+            '  '.join('{0:>24}'.format(label + ' ms/queries/sql ms') for label in labels)))
+        for page in results[labels[0]]:
+            self.stdout.write('{0}  {1}'.format(page.ljust(width), '  '.join(
+                '{ms:>10.1f} {queries:>5} {sql_ms:>7.1f}'.format(**results[label][page]).rjust(24)
+                for label in labels if page in results[label])))
+
+    def compare(self, results, baseline, tolerance):
+        """Print pages slower, or making more queries, than in the baseline."""
+        failures = 0
+        for scale, pages in results.items():
+            for page, result in pages.items():
+                before = baseline.get(scale, {}).get(page)
+                if before is None:
+                    continue
+                if result['ms'] > max(before['ms'] * tolerance, before['ms'] + NOISE_MS) or result['queries'] > before['queries']:
+                    failures += 1
+                    self.stderr.write('{0} at {1}: {2:.1f}ms and {3} queries, was {4:.1f}ms and {5}'
+                        .format(page, scale, result['ms'], result['queries'], before['ms'],
+                        before['queries']))
+        return failures
+
+    def check_growth(self, scales, results, max_exponent):
+        """Print pages whose time grows faster than the data, or whose query count grows."""
+        if len(scales) < 2:
+            return 0
+        small_size, large_size = scales[0][1], scales[-1][1]
+        small, large = results['{0}x{1}'.format(*scales[0])], results['{0}x{1}'.format(*scales[-1])]
+        failures = 0
+        for page in small:
+            if page not in large:
+                continue
+            exponent = growth(small[page]['ms'], large[page]['ms'], small_size, large_size)
+            if exponent > max_exponent:
+                failures += 1
+                self.stderr.write('{0}: time grows as size ** {1:.2f}'.format(page, exponent))
+            if large[page]['queries'] > small[page]['queries']:
+                # Expected of chunked reads such as exports; otherwise a sign of a query per row
+                self.stdout.write('{0}: {1} queries at {2}, {3} at {4}'.format(page,
+                    small[page]['queries'], scales[0][1], large[page]['queries'], large_size))
+        return failures
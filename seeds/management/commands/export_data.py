@@ -0,0 +1,34 @@
+"""Export a user's data to a file."""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from seeds import exporter
+
+class Command(BaseCommand):
+    """Write one user's data to a file or standard output."""
+    help = ('Export people, conversations, companies or sectors as CSV or JSON, '
+        'or everything ("all") as one JSON document.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=exporter.KINDS + ('all',))
+        parser.add_argument('--user', required=True, help='Username to export for.')
+        parser.add_argument('--format', choices=exporter.FORMATS, default='csv')
+        parser.add_argument('--output', help='File to write to; defaults to standard output.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No user named "{0}"'.format(options['user']))
+        if options['kind'] == 'all' and options['format'] != 'json':
+            raise CommandError('Exporting "all" needs --format json.')
+
+        chunks = exporter.export(user, options['kind'], options['format'],
+            chunk_size=options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as f:
+                f.writelines(chunks)
+        else:
+            for text in chunks:
+                self.stdout.write(text, ending='')
@@ -0,0 +1,40 @@
+"""Fill accounts with synthetic people and conversations."""
+from time import perf_counter
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from seeds import sampledata
+from seeds.models import Person, Conversation
+
+class Command(BaseCommand):
+    """Create benchmark accounts filled with reproducible synthetic data."""
+    help = ('Create accounts named <prefix>1, <prefix>2, ... each holding the given number of '
+        'people (with companies, sectors, partners and "known via" links) and conversations. '
+        'The same seed always generates the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1)
+        parser.add_argument('--people', type=int, default=200, help='People per user.')
+        parser.add_argument('--conversations', type=int, default=1000, help='Conversations per user.')
+        parser.add_argument('--prefix', default='demo', help='Start of the generated usernames.')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--replace', action='store_true',
+            help='Empty and refill accounts that already exist instead of stopping.')
+
+    def handle(self, *args, **options):
+        usernames = ['{0}{1}'.format(options['prefix'], i + 1) for i in range(options['users'])]
+        existing = list(User.objects.filter(username__in=usernames).values_list('username', flat=True))
+        if existing and not options['replace']:
+            raise CommandError('Users {0} already exist; use --replace to refill them.'.format(
+                ', '.join(sorted(existing))))
+
+        for username in usernames:
+            start = perf_counter()
+            user, errors = sampledata.generate(username, options['people'], options['conversations'],
+                seed=options['seed'])
+            for line, message in errors:
+                self.stderr.write('{0}, row {1}: {2}'.format(username, line, message))
+            self.stdout.write('{0}: {1} people, {2} conversations in {3:.1f}s'.format(username,
+                Person.objects.for_user(user).count(), Conversation.objects.for_user(user).count(), perf_counter() - start))
+        self.stdout.write(self.style.SUCCESS('Generated {0} users.'.format(len(usernames))))
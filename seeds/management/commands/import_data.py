@@ -0,0 +1,45 @@
+"""Import people or conversations from a file."""
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from seeds import importer
+
+class Command(BaseCommand):
+    """Import a file of people or conversations for one user, reporting problems by line."""
+    help = ('Import people or conversations from a CSV file with a header row, or people '
+        'from a vCard file. Separate several sectors or people in one cell with ";".')
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=['people', 'conversations'])
+        parser.add_argument('path')
+        parser.add_argument('--user', required=True, help='Username to import for.')
+        parser.add_argument('--format', choices=[f for f, _ in importer.FORMATS],
+            help='Defaults to vcard for .vcf files and csv otherwise.')
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError('No user named "{0}"'.format(options['user']))
+        fmt = options['format'] or importer.guess_format(options['path'])
+        if fmt == 'vcard' and options['kind'] != 'people':
+            raise CommandError('vCard files can only be imported as people.')
+
+        imp = importer.Importer(user, chunk_size=options['chunk_size'],
+            progress=lambda count: self.report(imp, count))
+        self.reported = 0
+        with open(options['path'], encoding='utf-8-sig', newline='') as f:
+            imp.run(options['kind'], importer.read(f, fmt))
+        self.report(imp)
+
+        self.stdout.write(self.style.SUCCESS('Imported {0} {1}; {2} problems.'.format(
+            imp.created, options['kind'], len(imp.errors))))
+
+    def report(self, imp, count=None):
+        """Print the errors found since the last report, then the progress."""
+        for line, message in imp.errors[self.reported:]:
+            self.stderr.write('Line {0}: {1}'.format(line, message))
+        self.reported = len(imp.errors)
+        if count is not None:
+            self.stdout.write('{0} rows read, {1} imported'.format(count, imp.created))
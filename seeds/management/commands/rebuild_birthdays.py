@@ -0,0 +1,18 @@
+"""Recompute the stored birthday key on every person."""
+from django.db.models.functions import ExtractDay, ExtractMonth
+
+from seeds.management.base import RebuildCommand
+from seeds.models import Person
+
+class Command(RebuildCommand):
+    """Recompute each person's birthday_key from their birthday."""
+    help = ('Rebuild birthday_key, the indexed month and day of each birthday, '
+        'e.g. after adding the column or changing birthdays with QuerySet.update.')
+    done = 'Updated birthdays for {0} people.'
+
+    def rebuild(self, user):
+        people = self.owned(Person.objects.all_objects(), user)
+        # One UPDATE; see seeds.birthdays.day_key
+        updated = people.update(birthday_key=ExtractMonth('birthday') * 100 + ExtractDay('birthday'))
+        self.changed(people)
+        return updated
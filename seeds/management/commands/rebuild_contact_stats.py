@@ -0,0 +1,15 @@
+"""Recompute the stored conversation stats and levels on every person."""
+from seeds.management.base import RebuildCommand
+from seeds.models import Person
+
+class Command(RebuildCommand):
+    """Recompute each person's conversation stats and level from their conversations."""
+    help = ('Rebuild num_conversations, first_contact, last_contact and level for each person, '
+        'e.g. after changing the LEVEL_ settings.')
+    done = 'Updated stats for {0} people.'
+
+    def rebuild(self, user):
+        people = self.owned(Person.objects.all_objects(), user)
+        updated = Person.objects.update_contact_stats(people.values('pk'))
+        self.changed(people)
+        return updated
@@ -0,0 +1,14 @@
+"""Recompute the stored participant summary on every conversation."""
+from seeds.management.base import RebuildCommand
+from seeds.models import Conversation
+
+class Command(RebuildCommand):
+    """Recompute each conversation's people_str and num_people from its participants."""
+    help = 'Rebuild people_str and num_people for each conversation.'
+    done = 'Updated {0} conversations.'
+
+    def rebuild(self, user):
+        conversations = self.owned(Conversation.objects.all_objects(), user)
+        Conversation.objects.update_people_str(conversations.values('pk'))
+        self.changed(conversations)
+        return conversations.count()
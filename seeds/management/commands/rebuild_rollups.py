@@ -0,0 +1,20 @@
+"""Backfill the weekly and monthly conversation rollups."""
+from django.contrib.auth.models import User
+
+from seeds.management.base import RebuildCommand
+from seeds.models import ConversationRollup
+from seeds.utils import bump_generation
+
+class Command(RebuildCommand):
+    """Recount each user's conversations per week and month from scratch."""
+    help = 'Rebuild the conversation rollups behind the trend chart.'
+    done = 'Rebuilt rollups for {0} users.'
+
+    def rebuild(self, user):
+        users = [user] if user else User.objects.iterator()
+        count = 0
+        for owner in users:
+            ConversationRollup.objects.rebuild(owner)
+            bump_generation(owner.pk)
+            count += 1
+        return count
@@ -0,0 +1,11 @@
+"""Rebuild the full-text search index."""
+from seeds import search
+from seeds.management.base import RebuildCommand
+
+class Command(RebuildCommand):
+    """Re-index the searchable text of every conversation and person."""
+    help = 'Re-index conversation summaries and notes and people notes for full-text search.'
+    done = 'Indexed {0} objects.'
+
+    def rebuild(self, user):
+        return search.rebuild(user)
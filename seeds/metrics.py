@@ -0,0 +1,261 @@
+"""Request metrics shared by every worker process, in Prometheus' text format.
+
+Each process adds up its requests in memory and, every METRICS_FLUSH_SECONDS,
+adds the totals into a small SQLite file (METRICS_DB) that all workers share.
+A request never waits for that file: when another process is writing to it,
+the totals are kept for the next flush.
+The `/metrics` page reads the totals back. Latencies are kept as histograms;
+query counts, SQL time and response sizes as sums per URL name.
+
+Requests slower than SLOW_REQUEST_SECONDS are logged to `seeds.metrics` with
+their SLOW_REQUEST_QUERIES slowest queries.
+"""
+import atexit
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from time import perf_counter
+
+from django.conf import settings
+from django.db import connections
+from django.utils.crypto import constant_time_compare
+
+METRICS_DB = getattr(settings, 'METRICS_DB', os.path.join(settings.PROJECT_ROOT, 'metrics.sqlite3'))
+METRICS_FLUSH_SECONDS = getattr(settings, 'METRICS_FLUSH_SECONDS', 5)
+SLOW_REQUEST_SECONDS = getattr(settings, 'SLOW_REQUEST_SECONDS', 1.0)
+SLOW_REQUEST_QUERIES = getattr(settings, 'SLOW_REQUEST_QUERIES', 5)
+# Who may read /metrics besides staff: requests sent with "Authorization: Bearer
+# <METRICS_TOKEN>", or from METRICS_ALLOWED_IPS
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+METRICS_ALLOWED_IPS = getattr(settings, 'METRICS_ALLOWED_IPS', ())
+
+# Upper bounds of the latency histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = (
+    ('seeds_request_duration_seconds', 'histogram', 'Time to build and send the response.'),
+    ('seeds_requests_total', 'counter', 'Responses, by status code.'),
+    ('seeds_request_queries_total', 'counter', 'SQL queries run while responding.'),
+    ('seeds_request_sql_seconds_total', 'counter', 'Time spent in SQL while responding.'),
+    ('seeds_response_bytes_total', 'counter', 'Size of response bodies.'),
+)
+
+logger = logging.getLogger(__name__)
+
+class QueryTimer(object):
+    """Database execute wrapper counting queries and their time.
+
+    Django's own query log rounds each time to the millisecond and only runs
+    with DEBUG. With `keep`, the SQL of the `keep` slowest queries is kept as
+    well, in `slowest`, so memory stays flat however many queries run.
+    """
+    def __init__(self, keep=0):
+        self.count = 0
+        self.time = 0
+        self.keep = keep
+        self.slowest = []
+        # Pages such as the dashboard run queries in several threads at once
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = perf_counter() - start
+            with self.lock:
+                self.time += elapsed
+                self.count += 1
+                if len(self.slowest) < self.keep:
+                    heapq.heappush(self.slowest, (elapsed, sql))
+                elif self.keep and elapsed > self.slowest[0][0]:
+                    heapq.heapreplace(self.slowest, (elapsed, sql))
+
+@contextmanager
+def timing(timer):
+    """Run `timer` around the queries of every database alias, such as a read alias."""
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timer))
+        yield timer
+
+class Store(object):
+    """Totals as (metric, view, label) -> value, added up in a process then in METRICS_DB."""
+    def __init__(self, path):
+        self.path = path
+        self.pending = Counter()
+        self.lock = threading.Lock()
+        # Held while using the connection, which the threads of a process share
+        self.db_lock = threading.Lock()
+        self.last_flush = perf_counter()
+        self._db = None
+        self._pid = None
+
+    def db(self):
+        # Connections are not shared with processes forked after opening one
+        if self._pid != os.getpid():
+            self._db = sqlite3.connect(self.path, timeout=5, isolation_level=None,
+                check_same_thread=False)
+            self._db.execute('CREATE TABLE IF NOT EXISTS metrics (metric TEXT, view TEXT, '
+                'label TEXT, value REAL, PRIMARY KEY (metric, view, label))')
+            self._pid = os.getpid()
+        return self._db
+
+    def add(self, values):
+        """Add to the totals, and flush them if they were last flushed a while ago."""
+        with self.lock:
+            self.pending.update(values)
+            due = perf_counter() - self.last_flush > METRICS_FLUSH_SECONDS
+        if due:
+            self.flush(wait=False)
+
+    def flush(self, wait=True):
+        """Add the pending totals into METRICS_DB.
+
+        Without `wait`, give up at once if another thread or process is
+        writing, and keep the totals for the next flush.
+        """
+        if not self.db_lock.acquire(wait):
+            return
+        try:
+            with self.lock:
+                pending, self.pending = self.pending, Counter()
+                self.last_flush = perf_counter()
+            if not pending:
+                return
+            try:
+                db = self.db()
+                db.execute('PRAGMA busy_timeout = {0}'.format(5000 if wait else 0))
+                db.execute('BEGIN IMMEDIATE')
+                db.executemany('INSERT INTO metrics VALUES (?, ?, ?, ?) ON CONFLICT '
+                    '(metric, view, label) DO UPDATE SET value = value + excluded.value',
+                    [key + (value,) for key, value in pending.items()])
+                db.execute('COMMIT')
+            except sqlite3.Error as e:
+                if wait or 'locked' not in str(e):
+                    logger.exception('Could not save metrics to %s', self.path)
+                if self._db is not None and self._db.in_transaction:
+                    self._db.execute('ROLLBACK')
+                # Keep the totals for the next try
+                with self.lock:
+                    self.pending.update(pending)
+        finally:
+            self.db_lock.release()
+
+    def totals(self):
+        """Every process' flushed totals, as {metric: [(view, label, value)]}."""
+        self.flush()
+        with self.db_lock:
+            rows = self.db().execute('SELECT metric, view, label, value FROM metrics '
+                'ORDER BY metric, view, label').fetchall()
+        totals = {}
+        for metric, view, label, value in rows:
+            totals.setdefault(metric, []).append((view, label, value))
+        return totals
+
+store = Store(METRICS_DB)
+atexit.register(store.flush)
+
+def record(view, status, duration, queries, sql_time, size):
+    """Count one response."""
+    bucket = next((str(le) for le in BUCKETS if duration <= le), '+Inf')
+    store.add({
+        ('seeds_request_duration_seconds', view, bucket): 1,
+        ('seeds_request_duration_seconds', view, 'sum'): duration,
+        ('seeds_requests_total', view, str(status)): 1,
+        ('seeds_request_queries_total', view, ''): queries,
+        ('seeds_request_sql_seconds_total', view, ''): sql_time,
+        ('seeds_response_bytes_total', view, ''): size,
+    })
+
+def log_slow(request, duration, timer):
+    if SLOW_REQUEST_SECONDS is None or duration < SLOW_REQUEST_SECONDS:
+        return
+    slowest = sorted(timer.slowest, reverse=True)
+    logger.warning('Slow request: %s %s took %.0fms with %d queries in %.0fms%s',
+        request.method, request.get_full_path(), duration * 1000, timer.count, timer.time * 1000,
+        ''.join('\n  %.1fms %s' % (elapsed * 1000, sql) for elapsed, sql in slowest))
+
+def is_scraper(request):
+    """Whether the request may read the metrics under METRICS_TOKEN or METRICS_ALLOWED_IPS."""
+    if METRICS_TOKEN and constant_time_compare(request.META.get('HTTP_AUTHORIZATION', ''),
+            'Bearer ' + METRICS_TOKEN):
+        return True
+    return request.META.get('REMOTE_ADDR') in METRICS_ALLOWED_IPS
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _number(value):
+    return repr(int(value)) if value == int(value) else repr(value)
+
+def render():
+    """The totals in Prometheus' text exposition format."""
+    totals = store.totals()
+    lines = []
+    for metric, kind, help_text in METRICS:
+        lines += ['# HELP {0} {1}'.format(metric, help_text), '# TYPE {0} {1}'.format(metric, kind)]
+        rows = totals.get(metric, [])
+        if kind == 'histogram':
+            views = {}
+            for view, label, value in rows:
+                views.setdefault(view, {})[label] = value
+            for view, values in sorted(views.items()):
+                # Buckets are stored one by one; Prometheus wants running totals
+                count = 0
+                for le in [str(le) for le in BUCKETS] + ['+Inf']:
+                    count += values.get(le, 0)
+                    lines.append('{0}_bucket{{view="{1}",le="{2}"}} {3}'.format(
+                        metric, _label(view), le, _number(count)))
+                lines.append('{0}_sum{{view="{1}"}} {2}'.format(metric, _label(view),
+                    _number(values.get('sum', 0))))
+                lines.append('{0}_count{{view="{1}"}} {2}'.format(metric, _label(view), _number(count)))
+        else:
+            for view, label, value in rows:
+                labels = 'view="{0}"'.format(_label(view)) + (
+                    ',status="{0}"'.format(label) if label else '')
+                lines.append('{0}{{{1}}} {2}'.format(metric, labels, _number(value)))
+    return '\n'.join(lines) + '\n'
+
+class MetricsMiddleware(object):
+    """Time each request and count its queries and bytes, by URL name.
+
+    Goes first in MIDDLEWARE so the time includes the other middleware.
+    Streamed responses are measured once their content has been sent.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = perf_counter()
+        timer = QueryTimer(keep=SLOW_REQUEST_QUERIES if SLOW_REQUEST_SECONDS is not None else 0)
+        with timing(timer):
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match else 'unmatched'
+        if response.streaming:
+            response.streaming_content = self.stream(request, response, response.streaming_content,
+                view, start, timer)
+        else:
+            self.finish(request, response, view, start, timer, len(response.content))
+        return response
+
+    def stream(self, request, response, content, view, start, timer):
+        size = 0
+        try:
+            with timing(timer):
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            self.finish(request, response, view, start, timer, size)
+
+    def finish(self, request, response, view, start, timer, size):
+        duration = perf_counter() - start
+        record(view, response.status_code, duration, timer.count, timer.time, size)
+        log_slow(request, duration, timer)
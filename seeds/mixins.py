@@ -1,9 +1,15 @@
 """Reusable classes for the app."""
+import hashlib
+
+from django.contrib import messages
 from django.contrib.auth.models import User
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
-from .utils import slugify
+from .utils import bump_generation, get_generation, slugify
 
 class UserManager(models.Manager):
     """Manager to filter objects by the user who created them."""
@@ -36,15 +42,78 @@ class BaseModel(models.Model):
     class Meta:
         abstract = True
 
+    # Attempts at saving when a concurrent save takes the chosen slug first
+    slug_retries = 3
+
+    # Fields the slug is made from; it is only recomputed when one of them changes
+    slug_fields = ('name',)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(BaseModel, cls).from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _field_values(self):
+        # Deferred fields are missing from __dict__; reading them would query
+        return {field.attname: self.__dict__[field.attname]
+            for field in self._meta.concrete_fields if field.attname in self.__dict__}
+
+    def get_dirty_fields(self):
+        """Names of the fields changed since the object was loaded or last saved.
+
+        Every field counts as changed on objects that were never loaded.
+        """
+        loaded = getattr(self, '_loaded_values', None)
+        dirty = set()
+        for field in self._meta.concrete_fields:
+            if field.primary_key or field.attname not in self.__dict__:
+                continue
+            if loaded is None or loaded.get(field.attname) != self.__dict__[field.attname]:
+                dirty.add(field.name)
+        return dirty
+
     def save(self, *args, **kwargs):
-        if hasattr(self, 'slug'):
+        """Write only the changed fields of loaded objects, and update the slug if needed."""
+        dirty = self.get_dirty_fields()
+        if (self.pk is not None and hasattr(self, '_loaded_values') and
+                not args and not kwargs.get('force_insert') and kwargs.get('update_fields') is None):
+            kwargs['update_fields'] = dirty | {'modified_on'}
+
+        if hasattr(self, 'slug') and (self.pk is None or not self.slug or dirty & set(self.slug_fields)):
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'slug'}
+            self._save_with_slug(*args, **kwargs)
+        else:
+            super(BaseModel, self).save(*args, **kwargs)
+
+        old_owner = getattr(self, '_loaded_values', {}).get('created_by_id', self.created_by_id)
+        if old_owner != self.created_by_id:
+            bump_generation(old_owner)
+        bump_generation(self.created_by_id)
+        self._loaded_values = self._field_values()
+
+    def _save_with_slug(self, *args, **kwargs):
+        old_slug = self.slug
+        for attempt in range(self.slug_retries):
+            self.slug = old_slug
             self.slug = slugify(self)
-        super(BaseModel, self).save(*args, **kwargs)
+            try:
+                with transaction.atomic():
+                    return super(BaseModel, self).save(*args, **kwargs)
+            except IntegrityError:
+                # Only retry if someone else now holds the slug
+                clash = type(self).objects.all_objects().filter(
+                    created_by=self.created_by_id, slug=self.slug).exclude(pk=self.pk)
+                if attempt == self.slug_retries - 1 or not clash.exists():
+                    raise
 
     def delete(self, force=True, **kwargs):
         """Change active to False rather than deleting the object."""
         if force:
-            return super(BaseModel, self).delete(**kwargs)
+            deleted = super(BaseModel, self).delete(**kwargs)
+            bump_generation(self.created_by_id)
+            return deleted
         elif self.active:
             self.active = False
             self.save()
@@ -81,3 +150,30 @@ class UserFormMixin(object):
         kwargs = super(UserFormMixin, self).get_form_kwargs()
         kwargs['user'] = self.request.user
         return kwargs
+
+class ConditionalGetMixin(object):
+    """Answer GETs with 304 Not Modified while the user's data is unchanged.
+
+    The ETag is computed before the view runs, from the user's data generation,
+    the URL with its query string, today's date (pages show relative dates) and
+    the CSRF cookie embedded in forms. The generation is read from the database
+    (see get_generation), so a write handled by any worker process changes the
+    ETag every other worker computes. Responses are marked private and must be
+    revalidated, so browsers keep them but always ask first.
+
+    Put it after LoginRequiredMixin so anonymous users are still redirected.
+    """
+    def get_etag(self, request, *args, **kwargs):
+        # Pages showing a one-off message must not be served again from the browser cache
+        if not request.user.is_authenticated or len(messages.get_messages(request)):
+            return None
+        key = (request.user.pk, get_generation(request.user.pk), request.get_full_path(),
+            timezone.now().date(), request.META.get('CSRF_COOKIE'))
+        return hashlib.md5(repr(key).encode()).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        view = condition(etag_func=self.get_etag)(super(ConditionalGetMixin, self).dispatch)
+        response = view(request, *args, **kwargs)
+        if response.has_header('ETag'):
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -1,15 +1,95 @@
 """Basic models."""
-from django.db import models
+from django.contrib.auth.models import User
+from django.db import connection, models, transaction
+from django.db.models import Count, Min, Max, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncWeek, TruncMonth
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.urls import reverse
 
 from hashid_field import HashidAutoField
 
+from . import birthdays, scoring
 from .mixins import BaseModel, UserManager
+from .utils import PERIOD_STARTS
+
+class PersonManager(UserManager):
+    """Person queries, plus the upkeep of their stored contact stats."""
+    def update_contact_stats(self, people=None):
+        """Recompute the stored conversation stats for `people` (default: everyone).
+
+        Accepts a queryset or a list of primary keys. The counts and dates are
+        a single UPDATE; levels are scored in Python (see update_levels).
+        """
+        qs = self.all_objects()
+        if people is not None:
+            qs = qs.filter(pk__in=people)
+
+        contacts = (Conversation.people.through.objects
+            .filter(person=OuterRef('pk'), conversation__active=True)
+            .order_by()
+            .values('person'))
+        updated = qs.update(
+            num_conversations=Coalesce(Subquery(
+                contacts.annotate(n=Count('conversation')).values('n'),
+                output_field=IntegerField()), 0),
+            first_contact=Subquery(contacts.annotate(d=Min('conversation__date')).values('d')),
+            last_contact=Subquery(contacts.annotate(d=Max('conversation__date')).values('d')),
+        )
+        self.update_levels(people)
+        return updated
+
+    def update_levels(self, people=None):
+        """Rescore `people` (default: everyone) from their conversations; see seeds.scoring.
+
+        Reads every participation in one query, and writes back only the levels
+        that changed, with one prepared UPDATE.
+        """
+        qs = self.all_objects()
+        if people is not None:
+            qs = qs.filter(pk__in=people)
+
+        levels = scoring.levels(Conversation.people.through.objects
+            .filter(person__in=qs, conversation__active=True)
+            .values_list('person_id', 'conversation__date', 'conversation__mode',
+                'conversation__seed')
+            .iterator())
+        changed = [(levels.get(pk, 0), pk) for pk, level in qs.values_list('pk', 'level').iterator()
+            if abs(levels.get(pk, 0) - level) > 1e-9]
+        if changed:
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany('UPDATE {0} SET level = %s WHERE id = %s'.format(
+                    self.model._meta.db_table), changed)
+        return len(changed)
+
+    def upcoming_birthdays(self, user, days=14, limit=None, today=None):
+        """The user's people with a birthday in the `days` days from today, soonest first.
+
+        Each is given `next_birthday` and `days_until`. This is a range scan of
+        person_birthday_idx, or two when the days run into the new year.
+        """
+        today = today or timezone.now().date()
+        people = []
+        for low, high in birthdays.key_ranges(today, days):
+            if limit is not None and len(people) >= limit:
+                break
+            qs = (self.for_user(user)
+                .filter(birthday_key__gte=low, birthday_key__lte=high)
+                .select_related('partner', 'known_via', 'company')
+                .order_by('birthday_key', 'last_name', 'first_name'))
+            people += qs[:limit - len(people)] if limit is not None else qs
+        for person in people:
+            person.next_birthday = birthdays.next_birthday(person.birthday, today)
+            person.days_until = (person.next_birthday - today).days
+        return people
 
 class Person(BaseModel):
     """Model for a person."""
+    objects = PersonManager()
+
+    # `name` falls back on the partner, known via or company without a last name
+    slug_fields = ('first_name', 'last_name', 'partner', 'known_via', 'company')
+
     first_name = models.CharField(max_length=64, default='', blank=True)
     last_name = models.CharField(max_length=64, default='', blank=True)
     partner = models.OneToOneField('self', on_delete=models.SET_NULL, blank=True, null=True, 
@@ -25,15 +105,36 @@ class Person(BaseModel):
 
     city = models.CharField(max_length=50, default='Chicago', blank=True)
     birthday = models.DateField(blank=True, null=True, help_text='Use any year if unknown.')
+    birthday_key = models.PositiveSmallIntegerField(blank=True, null=True, editable=False,
+        help_text='Month and day of the birthday as MMDD; see seeds/birthdays.py.')
     address = models.TextField(default='', blank=True)
 
     notes = models.TextField(default='', blank=True)
-    level = models.FloatField(default=0, editable=False, help_text="Classification of contact")
+    level = models.FloatField(default=0, editable=False,
+        help_text='Strength of the relationship; see seeds/scoring.py.')
+
+    # Denormalized from conversations; kept current by signals (see signals.py)
+    num_conversations = models.PositiveIntegerField(default=0, editable=False, db_index=True)
+    first_contact = models.DateField(blank=True, null=True, editable=False)
+    last_contact = models.DateField(blank=True, null=True, editable=False, db_index=True)
 
     class Meta:
         verbose_name_plural = 'people'
         unique_together = ('slug', 'created_by')
         ordering = ('first_name', 'last_name')
+        # Every list is one user's active people in some order; see the audit_queries command
+        indexes = [
+            models.Index(fields=['created_by', 'active', '-last_contact', 'last_name', 'first_name'],
+                name='person_list_idx'),
+            models.Index(fields=['created_by', 'active', '-level', 'last_name', 'first_name'],
+                name='person_level_idx'),
+            models.Index(fields=['created_by', 'active', 'created_on'], name='person_added_idx'),
+            models.Index(fields=['created_by', 'active', 'city'], name='person_city_idx'),
+            models.Index(fields=['created_by', 'active', 'birthday_key', 'last_name', 'first_name'],
+                name='person_birthday_idx'),
+            models.Index(fields=['company', '-last_contact', 'last_name', 'first_name'],
+                name='person_company_idx'),
+        ]
 
     @property
     def name(self):
@@ -47,22 +148,27 @@ class Person(BaseModel):
     def __str__(self):
         return self.name
 
+    @property
+    def strength(self):
+        return scoring.strength(self.level)
+
     def save(self, *args, **kwargs):
-        # If partner removed or changed, need to remove on their side too
-        old_partner = None
-        if self.id:
-            obj = Person.objects.get(id=self.id)
-            old_partner = obj.partner
-        super(Person, self).save(*args, **kwargs)
-
-        if old_partner and old_partner != self.partner:
-            # Partner changed
-            old_partner.partner = None
-            super(Person, old_partner).save()
-        # If new partner, need to save on their side too
-        if self.partner and not self.partner.partner == self:
-            self.partner.partner = self
-            super(Person, self.partner).save()
+        """Keep partners mutual: the old partner is left single and the new one points back."""
+        self.birthday_key = birthdays.day_key(self.birthday)
+        if kwargs.get('update_fields') is not None and 'birthday' in kwargs['update_fields']:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'birthday_key'}
+        loaded = getattr(self, '_loaded_values', None) or {}
+        old_partner_id = loaded.get('partner_id')
+        partner_changed = 'partner' in self.get_dirty_fields()
+
+        with transaction.atomic():
+            super(Person, self).save(*args, **kwargs)
+            if partner_changed:
+                people = Person.objects.all_objects()
+                if old_partner_id:
+                    people.filter(pk=old_partner_id, partner=self.pk).update(partner=None)
+                if self.partner_id:
+                    people.filter(pk=self.partner_id).update(partner=self.pk)
 
     def get_absolute_url(self):
         return reverse('person_detail', kwargs={'slug': self.slug})
@@ -76,6 +182,9 @@ class Company(BaseModel):
         verbose_name_plural = 'companies'
         ordering = ('name',)
         unique_together = ('slug', 'created_by')
+        indexes = [
+            models.Index(fields=['created_by', 'active', 'name'], name='company_list_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -107,6 +216,9 @@ class Sector(BaseModel):
     class Meta:
         ordering = ('name',)
         unique_together = ('slug', 'created_by')
+        indexes = [
+            models.Index(fields=['created_by', 'active', 'name'], name='sector_list_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -116,9 +228,32 @@ class Sector(BaseModel):
 
 
 class ConversationManager(UserManager):
+    """Conversation queries, plus the upkeep of their stored participant summary."""
     def seeds(self):
         return super(ConversationManager, self).get_queryset().filter(seed=False)
 
+    def update_people_str(self, conversations):
+        """Recompute the stored participant summary and count for `conversations`.
+
+        Accepts a queryset or a list of primary keys. Conversations that end up
+        with the same summary are updated together.
+        """
+        conversations = self.all_objects().filter(pk__in=conversations)
+        people = {}
+        through = Conversation.people.through
+        for row in (through.objects
+                .filter(conversation__in=conversations, person__active=True)
+                .select_related('person__partner', 'person__known_via', 'person__company')
+                .order_by('person__first_name', 'person__last_name')):
+            people.setdefault(int(row.conversation_id), []).append(row.person)
+
+        groups = {}
+        for pk in conversations.values_list('pk', flat=True):
+            found = people.get(int(pk), [])
+            groups.setdefault((Conversation.describe_people(found), len(found)), []).append(pk)
+        for (people_str, num_people), pks in groups.items():
+            self.all_objects().filter(pk__in=pks).update(people_str=people_str, num_people=num_people)
+
 class Conversation(BaseModel):
     """A conversation, reciprocated or not, with a person."""
     objects = ConversationManager()
@@ -141,8 +276,20 @@ class Conversation(BaseModel):
     location = models.CharField(max_length=64, default='', blank=True)
     notes = models.TextField(help_text='A summary of the conversation.', blank=True)
 
+    # Denormalized from people; kept current by signals (see signals.py)
+    people_str = models.CharField(max_length=255, default='', editable=False,
+        help_text='Human-friendly list of people in this conversation.')
+    num_people = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         ordering = ('-date', 'mode')
+        indexes = [
+            # Matches the default ordering, with the id as the final tie-breaker
+            models.Index(fields=['created_by', 'active', '-date', 'mode'], name='conversation_list_idx'),
+            # Covers the day-by-day trend counts
+            models.Index(fields=['created_by', 'active', 'date', 'seed', 'mode'],
+                name='conversation_trend_idx'),
+        ]
 
     def __str__(self):
         return '{0} on {1:%b %-d}: {2} ({3})'.format(
@@ -161,29 +308,29 @@ class Conversation(BaseModel):
     def get_absolute_url(self):
         return reverse('conversation_detail', kwargs={'pk': self.pk})
 
-    @property
-    def people_str(self):
-        """Human-friendly list of people in this conversation."""
-        people = list(self.people.all())
+    @staticmethod
+    def describe_people(people):
+        """Human-friendly list of `people`, who should be ordered by name."""
         if not len(people):
-            return ''
+            description = ''
         elif len(people) == 1:
-            return str(people[0])
+            description = str(people[0])
         elif len(people) == 2:
-            return '{0} & {1}'.format(
+            description = '{0} & {1}'.format(
                 people[0].first_name,
                 people[1].first_name,
             )
         elif len(people) == 3:
-            return '{0}, {1}, and {2}'.format(
+            description = '{0}, {1}, and {2}'.format(
                 people[0].first_name,
                 people[1].first_name,
                 people[2].first_name)
         else:
-            return '{0}, {1}, and {2} others'.format(
+            description = '{0}, {1}, and {2} others'.format(
                 people[0].first_name,
                 people[1].first_name,
                 len(people) - 2)
+        return description[:Conversation._meta.get_field('people_str').max_length]
 
     def get_mode_icon(self):
         return {
@@ -196,3 +343,114 @@ class Conversation(BaseModel):
         }.get(self.mode)
 
 
+class ConversationRollupManager(models.Manager):
+    """Reads and maintains the per-period conversation counts."""
+    TRUNCATE = {
+        'week': TruncWeek,
+        'month': TruncMonth,
+    }
+
+    def _count(self, conversations, period):
+        """Count conversations per (period start, seed, mode)."""
+        return (conversations
+            .annotate(start=self.TRUNCATE[period]('date'))
+            .values('start', 'seed', 'mode')
+            .annotate(count=Count('pk'))
+            .order_by())
+
+    def counts(self, user, period, start, end):
+        """Return (date, seed, mode, count) rows that can be bucketed into `period`.
+
+        Uses the coarsest stored rollup that divides `period` evenly, and falls
+        back to counting the user's conversations by day. Either way it is a
+        single query over [start, end), which should be aligned to `period`.
+        """
+        source = {'week': 'week', 'month': 'month', 'quarter': 'month', 'year': 'month'}.get(period)
+        if source is None:
+            return (Conversation.objects.for_user(user)
+                .filter(date__gte=start, date__lt=end)
+                .values('date', 'seed', 'mode')
+                .annotate(count=Count('pk'))
+                .order_by()
+                .values_list('date', 'seed', 'mode', 'count'))
+        return (self
+            .filter(user=user, period=source, start__gte=start, start__lt=end)
+            .values_list('start', 'seed', 'mode', 'count'))
+
+    def refresh(self, user_id, dates):
+        """Recount the week and month buckets containing each of `dates` for a user."""
+        if user_id is None:
+            return
+        to_date = Conversation._meta.get_field('date').to_python
+        dates = set(to_date(d) for d in dates if d)
+
+        with transaction.atomic():
+            for period in self.TRUNCATE:
+                get_start = PERIOD_STARTS[period]
+                for start in set(get_start(d) for d in dates):
+                    end = get_start(start, offset=1)
+                    self.filter(user_id=user_id, period=period, start=start).delete()
+                    conversations = Conversation.objects.filter(
+                        created_by_id=user_id, date__gte=start, date__lt=end)
+                    self.bulk_create([
+                        self.model(user_id=user_id, period=period, **row)
+                        for row in self._count(conversations, period)
+                    ])
+
+    def rebuild(self, user):
+        """Recount every bucket for `user` from scratch."""
+        with transaction.atomic():
+            self.filter(user=user).delete()
+            conversations = Conversation.objects.filter(created_by=user)
+            for period in self.TRUNCATE:
+                self.bulk_create([
+                    self.model(user=user, period=period, **row)
+                    for row in self._count(conversations, period)
+                ], batch_size=500)
+
+class ConversationRollup(models.Model):
+    """Number of conversations per user, period, seed and mode.
+
+    Derived from Conversation and kept current by signals (see signals.py).
+    """
+    objects = ConversationRollupManager()
+
+    PERIODS = (
+        ('week', 'Week'),
+        ('month', 'Month'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='conversation_rollups')
+    period = models.CharField(max_length=8, choices=PERIODS)
+    start = models.DateField(help_text='First day of the week (Monday) or month.')
+    seed = models.BooleanField(default=False)
+    mode = models.CharField(max_length=16, choices=Conversation.MODES)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ('user', 'period', 'start')
+        unique_together = ('user', 'period', 'start', 'seed', 'mode')
+
+    def __str__(self):
+        return '{0} {1:%Y-%m-%d} {2}{3}: {4}'.format(
+            self.period,
+            self.start,
+            self.mode,
+            ' (seed)' if self.seed else '',
+            self.count,
+        )
+
+class DataVersion(models.Model):
+    """Counters that change whenever a user's data does, shared by every process.
+
+    Processes check them before using anything they cached about the user;
+    see get_generation in utils.py and fragments.py. Rows are created on the
+    first bump and updated in the same transaction as the data.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True,
+        related_name='data_version')
+    generation = models.BigIntegerField(default=0, help_text='Changes on any write.')
+    fragments = models.BigIntegerField(default=0,
+        help_text='Changes when cached list items may show an old name.')
+
+    def __str__(self):
+        return '{0}: {1}/{2}'.format(self.user_id, self.generation, self.fragments)
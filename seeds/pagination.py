@@ -0,0 +1,132 @@
+"""Keyset (cursor) pagination for list views.
+
+Instead of counting rows and skipping an OFFSET, each page is fetched with a
+WHERE clause that continues from the sort key of the last row shown, so every
+page costs the same. Cursors are opaque URL-safe strings.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+def encode_cursor(data):
+    text = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the decoded cursor, or None if it is missing or malformed."""
+    if not cursor:
+        return None
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+def _after(field, descending, value):
+    """Rows strictly after `value` in this column, with NULLs sorted as SQLite does (lowest)."""
+    if descending:
+        if value is None:
+            return Q(pk__in=[])
+        return Q(**{field + '__lt': value}) | Q(**{field + '__isnull': True})
+    if value is None:
+        return Q(**{field + '__isnull': False})
+    return Q(**{field + '__gt': value})
+
+def _equal(field, value):
+    if value is None:
+        return Q(**{field + '__isnull': True})
+    return Q(**{field: value})
+
+def keyset_filter(ordering, values):
+    """Q selecting the rows that sort after `values` under `ordering`."""
+    condition = Q(pk__in=[])
+    equal = Q()
+    for key, value in zip(ordering, values):
+        field, descending = key.lstrip('-'), key.startswith('-')
+        condition |= equal & _after(field, descending, value)
+        equal &= _equal(field, value)
+    return condition
+
+def reverse_ordering(ordering):
+    return [key[1:] if key.startswith('-') else '-' + key for key in ordering]
+
+class KeysetPage(object):
+    """Quacks enough like a Django Page for list templates."""
+    def __init__(self, object_list, number, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.number = number
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+def paginate(queryset, ordering, page_size, cursor=None, key=None):
+    """Return a KeysetPage of `queryset` sorted by `ordering`, starting at `cursor`.
+
+    `ordering` must end with a unique column so every row has a distinct key;
+    `key(obj)` returns those values for a row (by default, its attributes).
+    """
+    if key is None:
+        key = lambda obj: [getattr(obj, name.lstrip('-')) for name in ordering]
+    cursor = decode_cursor(cursor) or {}
+    number = cursor.get('page', 1)
+    backwards = cursor.get('direction') == 'previous'
+    values = cursor.get('values')
+    if not isinstance(number, int) or (values is not None and (
+            not isinstance(values, list) or len(values) != len(ordering))):
+        raise Http404('Invalid cursor.')
+
+    qs = queryset.order_by(*(reverse_ordering(ordering) if backwards else ordering))
+    try:
+        if values is not None:
+            qs = qs.filter(keyset_filter(reverse_ordering(ordering) if backwards else ordering, values))
+        rows = list(qs[:page_size + 1])
+    except (ValueError, TypeError, ValidationError):
+        raise Http404('Invalid cursor.')
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if backwards:
+        rows.reverse()
+
+    has_next = not backwards and has_more or backwards
+    has_previous = backwards and has_more or not backwards and values is not None
+    next_cursor = previous_cursor = None
+    if rows and has_next:
+        next_cursor = encode_cursor({
+            'direction': 'next', 'page': number + 1, 'values': key(rows[-1])})
+    if rows and has_previous and number > 1:
+        previous_cursor = encode_cursor({
+            'direction': 'previous', 'page': number - 1, 'values': key(rows[0])})
+    return KeysetPage(rows, number, next_cursor, previous_cursor)
+
+class KeysetPaginationMixin(object):
+    """Replaces ListView's paginate_by/OFFSET pagination with cursors.
+
+    Set `keyset_ordering`; the page is read from the `cursor` GET parameter.
+    """
+    keyset_ordering = None
+
+    def get_keyset_key(self, obj):
+        return [getattr(obj, name.lstrip('-')) for name in self.keyset_ordering]
+
+    def paginate_queryset(self, queryset, page_size):
+        page = paginate(queryset, self.keyset_ordering, page_size,
+            cursor=self.request.GET.get('cursor'), key=self.get_keyset_key)
+        return (None, page, page.object_list, page.has_other_pages())
@@ -0,0 +1,141 @@
+"""Synthetic accounts for trying out and benchmarking the app.
+
+Rows are generated lazily in the importer's format and loaded through
+`seeds.importer`, so stats, rollups and the search index are built the same
+way as for a real import.
+"""
+import random
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from . import fragments, search
+from .importer import Importer, SEPARATOR
+from .models import Person, Company, Sector, Group, Conversation, ConversationRollup
+from .utils import bump_generation
+
+FIRST_NAMES = (
+    'Aaron', 'Abby', 'Adam', 'Aisha', 'Alex', 'Amara', 'Ana', 'Ben', 'Bianca', 'Caleb',
+    'Carmen', 'Chen', 'Chloe', 'Dan', 'Daria', 'David', 'Elena', 'Eli', 'Emma', 'Ethan',
+    'Fatima', 'Felix', 'Grace', 'Hannah', 'Hugo', 'Ines', 'Isaac', 'Jade', 'James', 'Joel',
+    'Julia', 'Kai', 'Kate', 'Leo', 'Lina', 'Lucas', 'Maya', 'Mei', 'Nadia', 'Noah',
+    'Olga', 'Omar', 'Paul', 'Priya', 'Quinn', 'Rosa', 'Ruth', 'Sam', 'Sara', 'Seth',
+    'Sofia', 'Tariq', 'Tess', 'Theo', 'Uma', 'Vera', 'Will', 'Yara', 'Yusuf', 'Zoe',
+)
+LAST_NAMES = (
+    'Abbott', 'Adeyemi', 'Alvarez', 'Bauer', 'Becker', 'Brooks', 'Carter', 'Castillo', 'Chang',
+    'Cohen', 'Cruz', 'Das', 'Diaz', 'Dubois', 'Evans', 'Fischer', 'Fong', 'Garcia', 'Gupta',
+    'Hall', 'Hansen', 'Hayes', 'Ito', 'Jensen', 'Johnson', 'Kaur', 'Khan', 'Kim', 'Kowalski',
+    'Lee', 'Lopez', 'Meyer', 'Miller', 'Moreau', 'Morris', 'Murphy', 'Nakamura', 'Nguyen',
+    'Novak', 'Okafor', 'Olsen', 'Ortiz', 'Park', 'Patel', 'Perez', 'Petrov', 'Price', 'Quinn',
+    'Ramos', 'Reyes', 'Rossi', 'Russo', 'Sato', 'Schmidt', 'Shah', 'Silva', 'Singh', 'Smith',
+    'Stone', 'Suzuki', 'Tan', 'Taylor', 'Torres', 'Turner', 'Volkov', 'Wagner', 'Walsh',
+    'Wang', 'Weber', 'Wong', 'Wright', 'Young', 'Zhang', 'Zimmer',
+)
+CITIES = ('Chicago', 'Chicago', 'Chicago', 'Boston', 'Denver', 'London', 'New York', 'Paris',
+    'Seattle', 'Toronto')
+SECTORS = ('Friends', 'Family', 'Work', 'Church', 'School', 'Neighbours', 'Tech', 'Finance',
+    'Health', 'Education', 'Nonprofit', 'Music')
+COMPANY_WORDS = ('Acme', 'Blue', 'Bright', 'Cedar', 'Delta', 'Global', 'Harbor', 'Lake',
+    'North', 'Peak', 'River', 'Summit', 'Union', 'Vista')
+COMPANY_KINDS = ('Labs', 'Partners', 'Systems', 'University', 'Hospital', 'Group', 'Works')
+TOPICS = ('coffee', 'lunch', 'job search', 'moving', 'the kids', 'a new project', 'travel plans',
+    'the conference', 'a book', 'church', 'running', 'the weekend', 'grad school', 'a startup')
+WORDS = ('talked', 'about', 'plans', 'family', 'work', 'follow', 'up', 'next', 'month',
+    'introduce', 'hiking', 'music', 'recipes', 'budget', 'mentor', 'interview', 'garden')
+MODES = ('one on one', 'one on one', 'in group', 'phone', 'email', 'email', 'text', 'text', 'skype')
+
+def person_name(i):
+    """A distinct (first, last) name for every i below 60 * 74 * 74."""
+    first = FIRST_NAMES[i % len(FIRST_NAMES)]
+    i //= len(FIRST_NAMES)
+    last = LAST_NAMES[i % len(LAST_NAMES)]
+    if i >= len(LAST_NAMES):
+        last += '-' + LAST_NAMES[(i // len(LAST_NAMES)) % len(LAST_NAMES)]
+    return first, last
+
+def _sentence(rng, length):
+    return ' '.join(rng.choice(WORDS) for _ in range(length)).capitalize() + '.'
+
+def people_rows(count, rng):
+    """Yield (line, row) pairs of people, with companies, sectors and links between them."""
+    companies = ['{0} {1}'.format(rng.choice(COMPANY_WORDS), rng.choice(COMPANY_KINDS))
+        for _ in range(max(count // 20, 3))]
+    today = timezone.now().date()
+    for i in range(count):
+        first_name, last_name = person_name(i)
+        row = {
+            'first_name': first_name,
+            'last_name': last_name,
+            'city': rng.choice(CITIES),
+            'sectors': SEPARATOR.join(rng.sample(SECTORS, rng.choice((1, 1, 2, 3)))),
+            'notes': _sentence(rng, rng.randint(3, 15)) if rng.random() < 0.5 else '',
+        }
+        if rng.random() < 0.6:
+            row['company'] = rng.choice(companies)
+        if rng.random() < 0.7:
+            row['birthday'] = (today - timedelta(days=rng.randint(18 * 365, 80 * 365))).isoformat()
+        if i % 10 == 1:
+            # Every tenth pair of rows are partners
+            row['partner'] = ' '.join(person_name(i - 1))
+        if i and rng.random() < 0.2:
+            row['known_via'] = ' '.join(person_name(rng.randrange(i)))
+        yield i + 1, row
+
+def conversation_rows(count, people, rng, years=5):
+    """Yield (line, row) pairs of conversations among the first `people` generated names.
+
+    Dates lean towards the present and a few people get most of the conversations.
+    """
+    today = timezone.now().date()
+    for i in range(count):
+        mode = rng.choice(MODES)
+        participants = 1 if mode != 'in group' else rng.randint(2, 5)
+        names = set(' '.join(person_name(int(people * rng.random() ** 2)))
+            for _ in range(participants))
+        yield i + 1, {
+            'date': (today - timedelta(days=int(years * 365 * rng.random() ** 1.5))).isoformat(),
+            'people': SEPARATOR.join(names),
+            'mode': 'one on one' if mode == 'in group' and len(names) == 1 else mode,
+            'summary': '{0} {1}'.format(rng.choice(('Chat about', 'Caught up on', 'Asked about',
+                'Discussed')), rng.choice(TOPICS)),
+            'seed': 'yes' if mode in ('email', 'text') and rng.random() < 0.3 else '',
+            'notes': _sentence(rng, rng.randint(5, 30)) if rng.random() < 0.4 else '',
+        }
+
+def clear(user):
+    """Delete everything a user created.
+
+    Rows are deleted in bulk, skipping the signals that keep stats, rollups and the
+    search index current one object at a time; those are emptied wholesale instead.
+    """
+    with transaction.atomic():
+        Conversation.people.through.objects.filter(conversation__created_by=user).delete()
+        Group.people.through.objects.filter(group__created_by=user).delete()
+        Person.sectors.through.objects.filter(person__created_by=user).delete()
+        Person.objects.all_objects().filter(created_by=user).update(partner=None, known_via=None,
+            company=None)
+        for model in (Conversation, Group, Person, Company, Sector):
+            qs = model.objects.all_objects().filter(created_by=user)
+            qs._raw_delete(qs.db)
+        ConversationRollup.objects.filter(user=user).delete()
+        search.remove_owner(user)
+    bump_generation(user.pk)
+    fragments.invalidate(user.pk)
+
+def generate(username, people, conversations, seed=0, chunk_size=1000):
+    """Create (or refill) an account with `people` people and `conversations` conversations."""
+    user, created = User.objects.get_or_create(username=username)
+    if created:
+        user.set_unusable_password()
+        user.save()
+    else:
+        clear(user)
+
+    rng = random.Random('{0}:{1}'.format(seed, username))
+    importer = Importer(user, chunk_size=chunk_size)
+    importer.import_people(people_rows(people, rng))
+    importer.import_conversations(conversation_rows(conversations, people, rng))
+    return user, importer.errors
@@ -0,0 +1,60 @@
+"""Relationship strength of each person, stored as `Person.level`.
+
+Every conversation counts its mode's weight (a quarter of it for seeds), halved
+every LEVEL_HALF_LIFE days since it happened. Today's total would go stale by
+tomorrow, so `level` stores the same sum anchored at EPOCH instead:
+
+    level = H * log2(sum(weight * 2 ** ((date - EPOCH).days / H)))
+
+With one weight-1 conversation, `level` is the number of days from EPOCH to it;
+each doubling of the weight adds H. Today's strength is `strength(level)`. As
+every total decays at the same rate, ordering by `level` never changes with
+time, so only the people in a conversation are rescored when it changes.
+"""
+import math
+from datetime import date
+
+from django.conf import settings
+from django.utils import timezone
+
+EPOCH = date(1900, 1, 1)
+
+LEVEL_HALF_LIFE = getattr(settings, 'LEVEL_HALF_LIFE', 182)
+
+MODE_WEIGHTS = getattr(settings, 'LEVEL_MODE_WEIGHTS', {
+    'one on one': 1.0,
+    'in group': 0.6,
+    'skype': 0.8,
+    'phone': 0.8,
+    'email': 0.4,
+    'text': 0.3,
+})
+
+# Weight of an unanswered attempt relative to a conversation
+SEED_WEIGHT = getattr(settings, 'LEVEL_SEED_WEIGHT', 0.25)
+
+def levels(rows):
+    """Return {person id: level} from (person id, date, mode, seed) rows.
+
+    Terms are computed once per distinct (date, mode, seed), relative to today
+    so that they stay within floating point range.
+    """
+    shift = (timezone.now().date() - EPOCH).days
+    terms = {}
+    totals = {}
+    for person_id, day, mode, seed in rows:
+        key = (day, mode, seed)
+        term = terms.get(key)
+        if term is None:
+            weight = MODE_WEIGHTS.get(mode, 0) * (SEED_WEIGHT if seed else 1)
+            term = terms[key] = weight * 2 ** (((day - EPOCH).days - shift) / LEVEL_HALF_LIFE)
+        totals[person_id] = totals.get(person_id, 0) + term
+    return {person_id: shift + LEVEL_HALF_LIFE * math.log2(total) if total > 0 else 0
+        for person_id, total in totals.items()}
+
+def strength(level, today=None):
+    """Today's weighted, decayed number of conversations behind a stored level."""
+    if not level:
+        return 0
+    today = today or timezone.now().date()
+    return 2 ** ((level - (today - EPOCH).days) / LEVEL_HALF_LIFE)
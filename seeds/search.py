@@ -0,0 +1,174 @@
+"""Full-text search over conversations and people, backed by SQLite FTS5.
+
+Each indexed object is one row of the `seeds_search` virtual table. The rowid
+encodes the object (conversation id * 2, or person id * 2 + 1) so rows can be
+replaced without scanning, and the `owner` column holds a "u<user id>" token
+so the per-user restriction is part of the full-text match itself.
+"""
+import re
+
+from django.db import connection, transaction
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+from .models import Person, Conversation
+
+TABLE = 'seeds_search'
+CONVERSATION, PERSON = 0, 1
+
+# Markers that cannot appear in user text, turned into <mark> after escaping
+START_MARK, END_MARK = '\x02', '\x03'
+
+def create_table(**kwargs):
+    """Create the index table; connected to post_migrate."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS {0} USING fts5("
+            "title, body, owner, "
+            "tokenize = 'unicode61 remove_diacritics 1', prefix = '2 3')".format(TABLE))
+
+def _row(obj):
+    """Return (rowid, title, body, owner) for a conversation or person."""
+    if isinstance(obj, Conversation):
+        return (obj.pk.id * 2 + CONVERSATION, obj.summary, obj.notes,
+            'u{0}'.format(obj.created_by_id))
+    return (obj.pk * 2 + PERSON, (obj.first_name + ' ' + obj.last_name).strip(), obj.notes,
+        'u{0}'.format(obj.created_by_id))
+
+def update(obj):
+    """Add, replace or (if inactive or unowned) remove the object's row."""
+    rowid, title, body, owner = _row(obj)
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid = %s'.format(TABLE), [rowid])
+        if obj.active and obj.created_by_id:
+            _insert(cursor, [(rowid, title, body, owner)])
+
+def remove(obj):
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid = %s'.format(TABLE), [_row(obj)[0]])
+
+def remove_owner(user):
+    """Remove every row belonging to a user."""
+    with connection.cursor() as cursor:
+        cursor.execute('DELETE FROM {0} WHERE rowid IN (SELECT rowid FROM {0} WHERE {0} MATCH %s)'
+            .format(TABLE), ['owner:u{0}'.format(user.pk)])
+
+def insert(objs):
+    """Index many new objects at once, e.g. after `bulk_create`."""
+    rows = [_row(obj) for obj in objs if obj.active and obj.created_by_id]
+    with connection.cursor() as cursor:
+        return _insert(cursor, rows)
+
+def _insert(cursor, rows):
+    if rows:
+        cursor.executemany('INSERT INTO {0} (rowid, title, body, owner) VALUES (%s, %s, %s, %s)'
+            .format(TABLE), rows)
+    return len(rows)
+
+def rebuild(user=None, chunk_size=1000):
+    """Re-index every active conversation and person, optionally for one user."""
+    create_table()
+    conversations = Conversation.objects.exclude(created_by=None)
+    people = Person.objects.exclude(created_by=None)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if user is None:
+            cursor.execute('DELETE FROM {0}'.format(TABLE))
+        else:
+            conversations = conversations.filter(created_by=user)
+            people = people.filter(created_by=user)
+            remove_owner(user)
+
+        count = 0
+        for qs in (conversations, people):
+            rows = []
+            for obj in qs.iterator(chunk_size=chunk_size):
+                rows.append(_row(obj))
+                if len(rows) == chunk_size:
+                    count += _insert(cursor, rows)
+                    rows = []
+            count += _insert(cursor, rows)
+    return count
+
+def build_query(q):
+    """Turn free text into an FTS5 expression matching every word as a prefix."""
+    words = re.findall(r'\w+', q or '')
+    return ' '.join('"{0}"*'.format(word) for word in words)
+
+def highlight(text):
+    """Escape FTS5 output and turn the match markers into <mark> tags."""
+    return mark_safe(escape(text)
+        .replace(START_MARK, '<mark>')
+        .replace(END_MARK, '</mark>'))
+
+def _subquery(qs):
+    sql, params = qs.values('pk').query.sql_with_params()
+    return sql, list(params)
+
+def search(user, q, person=None, sector=None, date_since=None, date_until=None,
+        offset=0, limit=20):
+    """Return (results, has_more) for the user's best matches of `q`.
+
+    Filtering by person or date only returns conversations. Each result is a
+    dict with the matched `object`, its `kind`, and highlighted `title` and
+    `snippet`.
+    """
+    query = build_query(q)
+    if not query or not user.is_authenticated:
+        return [], False
+
+    conversations = Conversation.objects.for_user(user)
+    people = Person.objects.for_user(user)
+    if sector:
+        conversations = conversations.filter(people__sectors=sector)
+        people = people.filter(sectors=sector)
+    if person:
+        conversations = conversations.filter(people=person)
+    if date_since:
+        conversations = conversations.filter(date__gte=date_since)
+    if date_until:
+        conversations = conversations.filter(date__lt=date_until)
+
+    where = ['{0} MATCH %s'.format(TABLE)]
+    params = ['owner:u{0} AND {{title body}}: ({1})'.format(user.pk, query)]
+    filters, filter_params = [], []
+    if sector or person or date_since or date_until:
+        sql, sql_params = _subquery(conversations)
+        filters.append('(rowid %% 2 = {0} AND rowid / 2 IN ({1}))'.format(CONVERSATION, sql))
+        filter_params += sql_params
+        if sector and not (person or date_since or date_until):
+            sql, sql_params = _subquery(people)
+            filters.append('(rowid %% 2 = {0} AND rowid / 2 IN ({1}))'.format(PERSON, sql))
+            filter_params += sql_params
+        where.append('(' + ' OR '.join(filters) + ')')
+        params += filter_params
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT rowid, highlight({0}, 0, %s, %s), snippet({0}, 1, %s, %s, '…', 16) "
+            "FROM {0} WHERE {1} "
+            "ORDER BY bm25({0}, 10.0, 1.0, 0.0) LIMIT %s OFFSET %s".format(TABLE, ' AND '.join(where)),
+            [START_MARK, END_MARK, START_MARK, END_MARK] + params + [limit + 1, offset])
+        rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    encode = Conversation._meta.pk.encode_id
+    objects = {
+        CONVERSATION: Conversation.objects.in_bulk(
+            [encode(rowid // 2) for rowid, _, _ in rows if rowid % 2 == CONVERSATION]),
+        PERSON: Person.objects.in_bulk(
+            [rowid // 2 for rowid, _, _ in rows if rowid % 2 == PERSON]),
+    }
+    results = []
+    for rowid, title, snippet in rows:
+        kind = rowid % 2
+        obj = objects[kind].get(encode(rowid // 2) if kind == CONVERSATION else rowid // 2)
+        if obj is None:
+            continue
+        results.append({
+            'kind': 'conversation' if kind == CONVERSATION else 'person',
+            'object': obj,
+            'title': highlight(title),
+            'snippet': highlight(snippet),
+        })
+    return results, has_more
@@ -0,0 +1,154 @@
+"""Signal handlers that keep denormalized data in sync."""
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, pre_save, post_save, pre_delete, post_delete
+from django.dispatch import receiver
+
+from . import fragments, search
+from .models import Person, Company, Conversation, ConversationRollup
+from .utils import bump_generation
+
+@receiver(m2m_changed, sender=Conversation.people.through)
+def people_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Update contact stats for the people added to or removed from a conversation."""
+    if action == 'pre_clear':
+        # The affected people are gone by post_clear, so remember them now
+        if reverse:
+            instance._cleared_people = [instance.pk]
+        else:
+            instance._cleared_people = list(instance.people.values_list('pk', flat=True))
+    elif action == 'post_clear':
+        Person.objects.update_contact_stats(getattr(instance, '_cleared_people', []))
+    elif action in ('post_add', 'post_remove'):
+        if reverse:
+            Person.objects.update_contact_stats([instance.pk])
+        elif pk_set:
+            Person.objects.update_contact_stats(pk_set)
+
+@receiver(m2m_changed, sender=Conversation.people.through)
+def participants_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Refresh the stored participant summary of the conversations affected."""
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            Conversation.objects.update_people_str([instance.pk])
+    elif action == 'pre_clear':
+        instance._cleared_conversations = list(sender.objects
+            .filter(person=instance).values_list('conversation', flat=True))
+    elif action == 'post_clear':
+        Conversation.objects.update_people_str(getattr(instance, '_cleared_conversations', []))
+    elif action in ('post_add', 'post_remove') and pk_set:
+        Conversation.objects.update_people_str(pk_set)
+
+# Fields Person.name is made from, including the people it can fall back on
+NAME_FIELDS = {'first_name', 'last_name', 'partner', 'known_via', 'company', 'active'}
+
+def conversations_naming(people):
+    """Conversations whose summary shows any of `people`, or someone named after them."""
+    named_after = (Person.objects.all_objects()
+        .filter(Q(partner__in=people) | Q(known_via__in=people), last_name='')
+        .values('pk'))
+    return (Conversation.people.through.objects
+        .filter(Q(person__in=people) | Q(person__in=named_after))
+        .values('conversation'))
+
+@receiver(post_save, sender=Person)
+def person_renamed(sender, instance, created, raw, update_fields, **kwargs):
+    """Conversations list people by name, and some people by their partner's or contact's."""
+    if raw or (update_fields is not None and not NAME_FIELDS & set(update_fields)):
+        return
+    if not created or instance.partner_id:
+        # Other people can be shown by this person's name
+        fragments.invalidate(instance.created_by_id)
+    people = [instance.pk]
+    old_partner_id = (getattr(instance, '_loaded_values', None) or {}).get('partner_id')
+    if old_partner_id:
+        people.append(old_partner_id)
+    # Person.save links the partner back after this; refresh once that is done
+    transaction.on_commit(lambda: Conversation.objects.update_people_str(conversations_naming(people)))
+
+@receiver(post_save, sender=Company)
+def company_renamed(sender, instance, raw, update_fields, **kwargs):
+    """People without a last name are shown with their company."""
+    if raw or (update_fields is not None and not {'name', 'active'} & set(update_fields)):
+        return
+    fragments.invalidate(instance.created_by_id)
+    Conversation.objects.update_people_str(Conversation.people.through.objects
+        .filter(person__company=instance, person__last_name='').values('conversation'))
+
+@receiver(pre_delete, sender=Person)
+def person_deleting(sender, instance, **kwargs):
+    """Remember whose summaries change; the through rows are deleted without m2m_changed."""
+    instance._renamed_conversations = list(conversations_naming([instance.pk])
+        .values_list('conversation', flat=True))
+
+@receiver(post_delete, sender=Person)
+def person_deleted(sender, instance, **kwargs):
+    fragments.invalidate(instance.created_by_id)
+    Conversation.objects.update_people_str(getattr(instance, '_renamed_conversations', []))
+
+# Fields whose changes move a conversation between rollup buckets or contact stats
+COUNTED_FIELDS = {'created_by', 'date', 'mode', 'seed', 'active'}
+
+# Fields stored in the search index
+INDEXED_FIELDS = {
+    Person: {'first_name', 'last_name', 'notes', 'active', 'created_by'},
+    Conversation: {'summary', 'notes', 'active', 'created_by'},
+}
+
+@receiver(pre_save, sender=Conversation)
+def conversation_saving(sender, instance, raw, **kwargs):
+    """Remember where the conversation used to be counted in the rollups."""
+    instance._old_rollup_key = None
+    if instance.pk and not raw:
+        loaded = getattr(instance, '_loaded_values', None)
+        if loaded and 'date' in loaded:
+            instance._old_rollup_key = (loaded.get('created_by_id'), loaded['date'])
+        else:
+            instance._old_rollup_key = (Conversation.objects.all_objects()
+                .filter(pk=instance.pk)
+                .values_list('created_by', 'date')
+                .first())
+
+@receiver(post_save, sender=Conversation)
+def conversation_saved(sender, instance, created, raw, update_fields, **kwargs):
+    """The date, mode, seed or active flag may have changed."""
+    if raw or (update_fields is not None and not COUNTED_FIELDS & set(update_fields)):
+        return
+    old_user_id, old_date = getattr(instance, '_old_rollup_key', None) or (None, None)
+    if old_user_id != instance.created_by_id:
+        ConversationRollup.objects.refresh(old_user_id, [old_date])
+        old_date = None
+    ConversationRollup.objects.refresh(instance.created_by_id, [instance.date, old_date])
+
+    if not created:
+        # People are only attached to new conversations afterwards, via m2m_changed
+        Person.objects.update_contact_stats(instance.people.values('pk'))
+
+@receiver(pre_delete, sender=Conversation)
+def conversation_deleting(sender, instance, **kwargs):
+    """Remember participants; the through rows are deleted without m2m_changed."""
+    instance._deleted_people = list(instance.people.values_list('pk', flat=True))
+
+@receiver(post_delete, sender=Conversation)
+def conversation_deleted(sender, instance, **kwargs):
+    Person.objects.update_contact_stats(getattr(instance, '_deleted_people', []))
+    ConversationRollup.objects.refresh(instance.created_by_id, [instance.date])
+
+@receiver(post_save, sender=Person)
+@receiver(post_save, sender=Conversation)
+def index_for_search(sender, instance, raw, update_fields, **kwargs):
+    if raw or (update_fields is not None and not INDEXED_FIELDS[sender] & set(update_fields)):
+        return
+    search.update(instance)
+
+@receiver(post_delete, sender=Person)
+@receiver(post_delete, sender=Conversation)
+def remove_from_search(sender, instance, **kwargs):
+    search.remove(instance)
+
+@receiver(m2m_changed, sender=Conversation.people.through)
+@receiver(m2m_changed, sender=Person.sectors.through)
+def relation_changed(sender, instance, action, **kwargs):
+    """Saves and deletes start a new data generation themselves; related sets don't."""
+    if action.startswith('post_'):
+        bump_generation(instance.created_by_id)
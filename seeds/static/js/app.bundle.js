@@ -114,9 +114,23 @@ var home = function (_) {
 
     if (_utilities.default.isPath('dashboard')) {
       var chartPeriod = (0, _jquery.default)('.chart').data('period');
-      fetch("/api/trend/?period=".concat(chartPeriod)).then(function (data) {
-        return data.json();
+
+      var chartParams = _jquery.default.param({
+        period: chartPeriod,
+        start: (0, _jquery.default)('.chart').data('start') || '',
+        end: (0, _jquery.default)('.chart').data('end') || ''
+      }); // The series usually comes with the page; otherwise ask the API, revalidating
+      // the browser's copy (unchanged data comes back as a 304)
+
+
+      var inline = document.getElementById('chart-data');
+      var series = inline ? Promise.resolve(JSON.parse(inline.textContent)) : fetch("/api/trend/?".concat(chartParams), {
+        credentials: 'same-origin',
+        cache: 'no-cache'
       }).then(function (data) {
+        return data.json();
+      });
+      series.then(function (data) {
         return _chart.default.makeChart((0, _jquery.default)('.chart'), data, chartPeriod[0].toUpperCase() + chartPeriod.slice(1));
       });
     }
@@ -149,7 +163,7 @@ var home = function (_) {
           }
         });
       });
-    } else if (_utilities.default.isPath('personList') || _utilities.default.isPath('conversationList')) {
+    } else if (_utilities.default.isPath('personList') || _utilities.default.isPath('conversationList') || _utilities.default.isPath('search')) {
       initSelect2();
       (0, _jquery.default)('button.btn-input').on('click', function () {
         var $div = (0, _jquery.default)(this).closest('div'); // Translate buttons into form inputs
@@ -170,7 +184,7 @@ var home = function (_) {
     });
     (0, _jquery.default)('select.select2-enable').each(function (i, e) {
       var element = (0, _jquery.default)(e);
-      var options = {};
+      var options = remoteOptions(element);
       var control = element.select2(options);
 
       if (control.first().prop("multiple")) {
@@ -180,24 +194,82 @@ var home = function (_) {
         });
       }
     });
+  } // Options for selects that fetch their choices page by page from a JSON endpoint
+
+
+  function remoteOptions(element) {
+    var url = element.data('ajax-url');
+
+    if (!url) {
+      return {};
+    }
+
+    var nextCursor = null;
+    return {
+      width: '100%',
+      allowClear: !element.prop('multiple'),
+      placeholder: '',
+      ajax: {
+        dataType: 'json',
+        // Keep the browser cache; the API answers unchanged pages with a 304
+        cache: true,
+        delay: 150,
+        url: url,
+        data: function data(params) {
+          var query = {
+            q: (params.term || '').trim(),
+            key: 'pk',
+            exclude: element.data('exclude') || ''
+          };
+
+          if (params.page > 1 && nextCursor) {
+            query.cursor = nextCursor;
+          }
+
+          return query;
+        },
+        processResults: function processResults(data) {
+          nextCursor = data.next_cursor;
+          return {
+            results: data.people.map(function (p) {
+              return {
+                id: p.id,
+                text: p.name
+              };
+            }),
+            pagination: {
+              more: data.more_results
+            }
+          };
+        }
+      }
+    };
   }
 
   function initSearchBar() {
+    var nextCursor = null;
     (0, _jquery.default)(".navbar-form .api-search").select2({
       ajax: {
         dataType: 'json',
+        cache: true,
         delay: 150,
         url: "/api/people/",
         minimumInputLength: 1,
         data: function data(params) {
           params.term = params.term || '';
-          return {
-            q: params.term.trim(),
-            page: params.page || 1
+          var query = {
+            q: params.term.trim()
           };
+
+          if (params.page > 1 && nextCursor) {
+            query.cursor = nextCursor;
+          }
+
+          return query;
         },
         processResults: function processResults(data, params) {
-          params.page = params.page || 1; // add links
+          params.page = params.page || 1;
+          nextCursor = data.next_cursor; // add links
 
           var people = data.people.map(function (p) {
             p.url = '/people/' + p.id;
@@ -353,6 +425,8 @@ module.exports = function (_) {
       $('.navbar-nav .people').addClass('active');
     } else if (isPath('conversations')) {
       $('.navbar-nav .conversations').addClass('active');
+    } else if (isPath('search')) {
+      $('.navbar-nav .search').addClass('active');
     }
   }
 
@@ -365,7 +439,8 @@ module.exports = function (_) {
     personDetail: /^\/people\/[\w-]+\//,
     personEdit: /^\/people\/([\w-]+\/)?(edit|add)\//,
     conversationEdit: /^\/conversations\/(\w{3,}\/)?(edit|add)\//,
-    conversationCreate: /^\/conversations\/add\//
+    conversationCreate: /^\/conversations\/add\//,
+    search: /^\/search\//
   };
 
   function isPath(page) {
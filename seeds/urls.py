@@ -38,10 +38,23 @@ urlpatterns = [
     url(r'^companies/(?P<slug>[\w-]+)/$', views.CompanyUpdate.as_view(), name='company_update'),
     url(r'^companies/(?P<slug>[\w-]+)/delete/$', views.CompanyDelete.as_view(), name='company_delete'),
 
+    # Search
+    url(r'^search/$', views.Search.as_view(), name='search'),
+
+    # Import and export
+    url(r'^import/$', views.Import.as_view(), name='import'),
+    url(r'^export/(?P<kind>\w+)\.(?P<fmt>csv|json)$', views.Export.as_view(), name='export'),
+
     # API
     url(r'^api/people/$', views.PersonAPI.as_view(), name='person_api'),
+    url(r'^api/people/(?P<slug>[\w-]+)/connections/$', views.PersonConnectionsAPI.as_view(),
+        name='person_connections'),
+    url(r'^api/birthdays/$', views.BirthdayAPI.as_view(), name='birthday_api'),
     url(r'^api/trend/$', views.TrendAPI.as_view(), name='trend_api'),
 
+    # Monitoring
+    url(r'^metrics$', views.Metrics.as_view(), name='metrics'),
+
     # Admin
     url(r'^sanctum/doc/', include('django.contrib.admindocs.urls')),
     url(r'^sanctum/', admin.site.urls),
@@ -1,140 +1,358 @@
 """Reusable methods."""
+import hashlib
 import itertools
+import re
+import threading
+import time
+from collections import OrderedDict, namedtuple
 from datetime import date, timedelta
 
-from django.contrib.contenttypes.models import ContentType
-from django.db.models import Count
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Case, F, Q, When, IntegerField
 from django.utils import timezone
 from django.template.defaultfilters import slugify as dj_slugify
 
-def slugify(obj, attribute=None):
-    """Creates/updates the object's slug."""
-    ObjectClass = ContentType.objects.get_for_model(obj).model_class()
-    assert hasattr(ObjectClass, 'slug'), 'Object class does not have a slug field'
-    max_length = ObjectClass._meta.get_field('slug').max_length
-
+def get_slug_content(obj, attribute=None):
+    """Returns the string the object's slug is made from."""
     # Every model with a slug field needs to have a _slug_field method returning
     # the string that should be used to make the slug (e.g. self.title or self.name)
-    slug_content = None
+    ObjectClass = type(obj)
     if attribute and hasattr(ObjectClass, attribute):
-        slug_content = getattr(obj, attribute)
+        return getattr(obj, attribute)
     elif hasattr(ObjectClass, 'get_slug_content'):
-        slug_content = obj.get_slug_content()
+        return obj.get_slug_content()
     elif hasattr(ObjectClass, 'name'):
-        slug_content = obj.name
-    else:
-        raise Exception('Object class has no get_slug_content method or name field')
-
-    if obj.pk and obj.slug:
-        # Already has a slug - check that slug_content hasn't changed
-        if dj_slugify(slug_content)[:max_length] == obj.slug:
-            # No change needed
-            return obj.slug
+        return obj.name
+    raise Exception('Object class has no get_slug_content method or name field')
 
-    # Iteratively adjust slug to avoid duplicates
-    # Pattern is slug-content-1, slug-content-2, etc.
-    slug = orig = dj_slugify(slug_content)[:max_length]
+def slug_candidates(orig, max_length):
+    """Yields slug-content, slug-content-1, slug-content-2, etc."""
+    yield orig
     for slug_number in itertools.count(1):
-        existing = ObjectClass.objects.for_user(obj.created_by).exclude(pk=obj.pk).filter(slug=slug)
-        if not existing.exists():
-            break
-
         # Add hyphen-number and then truncate
-        slug = '%s-%d' % (orig[:max_length - len(str(slug_number)) - 1], slug_number)
+        yield '%s-%d' % (orig[:max_length - len(str(slug_number)) - 1], slug_number)
 
-    return slug
+def slug_prefix(orig, max_length):
+    """Prefix shared by the first 99999 candidates for a slug."""
+    return orig[:max_length - 6]
 
-def count_by_week(qs, days=90):
-    """Return a count of records for each week in the past X days."""
-    STARTING_POINT = timezone.now().date() - timedelta(days=min(days, 355)) # off so we don't double-count the current week
-    STARTING_POINT += timedelta(days = 6 - STARTING_POINT.weekday())  # sunday
+def slugify(obj, attribute=None):
+    """Creates/updates the object's slug.
 
-    conversations = list(qs
-        .filter(
-            seed=False,
-            date__gte=STARTING_POINT)
-        .values('date__week')
-        .order_by()
-        .annotate(count=Count('date__week')))
-    conversations = {t['date__week']: t['count'] for t in conversations}
-
-    seeds = list(qs
-        .filter(
-            seed=True,
-            date__gte=STARTING_POINT)
-        .values('date__week')
-        .order_by()
-        .annotate(count=Count('date__week')))
-    seeds = {t['date__week']: t['count'] for t in seeds}
-
-    def all_sundays():
-        d = STARTING_POINT
-        this_sunday = timezone.now().date() + timedelta(days=6 - timezone.now().weekday())
-        while d <= this_sunday:
-            yield d
-            d += timedelta(days=7)
-
-    conversations_by_week = []
-    seeds_by_week = []
-    weeks = []
-
-    for week in all_sundays():
-        # Thankfully, Python weeks end on sundays, so week_num is the same
-        weeks.append(week.strftime('%b %-d'))
-        conversations_by_week.append(conversations.get(week.isocalendar()[1], 0)) # week number
-        seeds_by_week.append(seeds.get(week.isocalendar()[1], 0))
-
-    return {
-        'dates': weeks,
-        'conversations': conversations_by_week,
-        'seeds': seeds_by_week,
-    }
+    The existing slugs among its candidates are fetched in one query and the
+    first free candidate is returned. Two concurrent saves can still pick the same
+    slug; `BaseModel.save` relies on the (slug, created_by) constraint and retries.
+    """
+    ObjectClass = type(obj)
+    assert hasattr(ObjectClass, 'slug'), 'Object class does not have a slug field'
+    max_length = ObjectClass._meta.get_field('slug').max_length
 
-def count_by_month(qs, months=12):
-    """Return a count of records for each month in the past X months."""
-    STARTING_POINT = timezone.now().date() - timedelta(days=round(months * 30.4, 0) - 31)
-    STARTING_POINT = date(STARTING_POINT.year, STARTING_POINT.month, 1) # first of month
+    orig = dj_slugify(get_slug_content(obj, attribute))[:max_length]
+    if obj.pk and obj.slug == orig:
+        # Already has a slug and slug_content hasn't changed
+        return obj.slug
 
-    conversations = list(qs
-        .filter(
-            seed=False,
-            date__gte=STARTING_POINT)
-        .values('date__month')
-        .order_by()
-        .annotate(count=Count('date__month')))
-    conversations = {t['date__month']: t['count'] for t in conversations}
-
-    seeds = list(qs
-        .filter(
-            seed=True,
-            date__gte=STARTING_POINT)
-        .values('date__month')
+    # Only `orig` and its numbered candidates; inactive objects are included,
+    # as they still hold their slug in the unique constraint
+    prefix = slug_prefix(orig, max_length)
+    # Long slugs are cut short to make room for the number
+    truncated = len(orig) - len(prefix)
+    numbered = '^' + re.escape(prefix) + ('[a-z0-9_-]{0,%d}' % truncated if truncated else '') + '-[0-9]+$'
+    taken = set(ObjectClass.objects.all_objects()
+        .filter(created_by=obj.created_by_id)
+        .filter(Q(slug=orig) | Q(slug__startswith=prefix, slug__regex=numbered))
+        .exclude(pk=obj.pk)
         .order_by()
-        .annotate(count=Count('date__month')))
-    seeds = {t['date__month']: t['count'] for t in seeds}
-
-    def all_months():
-        d = STARTING_POINT
-        this_month = timezone.now().month
-        while d.month != this_month:
-            yield d
-            if (d.month == 12):
-                d = date(d.year + 1, 1, 1)
+        .values_list('slug', flat=True))
+    for slug in slug_candidates(orig, max_length):
+        if slug not in taken:
+            return slug
+
+def assign_slugs(objs, attribute=None):
+    """Sets slugs on many new objects of one model, e.g. before `bulk_create`.
+
+    Uses a single query for all the slugs already held by the objects' owners,
+    so the cost does not grow with the number of objects or name collisions.
+    """
+    objs = list(objs)
+    if not objs:
+        return objs
+    ObjectClass = type(objs[0])
+    max_length = ObjectClass._meta.get_field('slug').max_length
+
+    owners = set(obj.created_by_id for obj in objs)
+    existing = ObjectClass.objects.all_objects().filter(created_by__in=owners - {None})
+    if None in owners:
+        existing = existing | ObjectClass.objects.all_objects().filter(created_by__isnull=True)
+    taken = {}
+    for owner, slug in existing.values_list('created_by', 'slug'):
+        taken.setdefault(owner, set()).add(slug)
+
+    for obj in objs:
+        owner_slugs = taken.setdefault(obj.created_by_id, set())
+        orig = dj_slugify(get_slug_content(obj, attribute))[:max_length]
+        for slug in slug_candidates(orig, max_length):
+            if slug not in owner_slugs:
+                break
+        obj.slug = slug
+        owner_slugs.add(slug)
+    return objs
+
+# How long results cached with `user_cache` are kept, at most
+USER_CACHE_TIMEOUT = 60 * 60
+
+def get_counter(user_id, name):
+    """The user's DataVersion counter `name`, or 0 if it was never bumped."""
+    from .models import DataVersion
+    return DataVersion.objects.filter(user_id=user_id).values_list(name, flat=True).first() or 0
+
+def bump_counter(user_id, name):
+    """Change the user's DataVersion counter `name` within the current transaction.
+
+    Other processes see the new value when, and only when, the data written
+    alongside it is committed.
+    """
+    from .models import DataVersion
+    if user_id is None:
+        return
+    versions = DataVersion.objects.filter(user_id=user_id)
+    if not versions.update(**{name: F(name) + 1}):
+        # Start from the clock, so a row recreated after a reset never repeats an old value
+        start = time.time_ns()
+        _, created = DataVersion.objects.get_or_create(user_id=user_id,
+            defaults={'generation': start, 'fragments': start})
+        if not created:
+            versions.update(**{name: F(name) + 1})
+
+def get_generation(user_id):
+    """The user's data generation, which changes whenever any of the user's data is written."""
+    return get_counter(user_id, 'generation')
+
+def bump_generation(user_id):
+    """Start a new generation for the user, taking effect when the current transaction commits.
+
+    `BaseModel.save` and `delete` and the many-to-many signals call this; code
+    writing with `QuerySet.update`, `bulk_create` and the like has to call it too.
+    """
+    bump_counter(user_id, 'generation')
+    if user_id is not None:
+        transaction.on_commit(lambda: _count_local_write(user_id))
+
+# New generations committed by this process, per user, so UserObjects notices them without a query
+_local_writes = {}
+
+def _count_local_write(user_id):
+    _local_writes[user_id] = _local_writes.get(user_id, 0) + 1
+
+_missing = object()
+
+def user_cache(user, key, compute, timeout=USER_CACHE_TIMEOUT):
+    """Return compute(), cached per user under `key` until any of the user's data changes.
+
+    `key` is anything with a stable repr, e.g. a tuple of strings, numbers and dates.
+    """
+    digest = hashlib.md5(repr(key).encode()).hexdigest()
+    cache_key = 'user-cache:{0}:{1}:{2}'.format(user.pk, get_generation(user.pk), digest)
+    result = cache.get(cache_key, _missing)
+    if result is _missing:
+        result = compute()
+        cache.set(cache_key, result, timeout)
+    return result
+
+# How long UserObjects trusts a generation it read before reading it again, in seconds
+GENERATION_CHECK_INTERVAL = getattr(settings, 'GENERATION_CHECK_INTERVAL', 1)
+
+_Built = namedtuple('_Built', 'obj generation checked local_writes')
+
+class UserObjects(object):
+    """Objects built from one user's data, kept in memory for the `size` most recently used users.
+
+    An object is rebuilt when the user's data generation changed since it was
+    built. The generation is read from the database at most once every
+    GENERATION_CHECK_INTERVAL seconds per user, so quick successive requests
+    (typeahead keystrokes) are answered without a query: writes committed by
+    this process are seen at once, writes by other processes within the interval.
+    """
+    def __init__(self, build, size, check_interval=GENERATION_CHECK_INTERVAL):
+        self.build = build
+        self.size = size
+        self.check_interval = check_interval
+        self._built = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user):
+        """Return the user's object, building it if missing or out of date."""
+        now = time.monotonic()
+        local_writes = _local_writes.get(user.pk, 0)
+        with self._lock:
+            built = self._built.get(user.pk)
+        if (built is None or built.local_writes != local_writes or
+                now - built.checked >= self.check_interval):
+            generation = get_generation(user.pk)
+            if built is None or built.generation != generation:
+                # Built outside the lock; two requests may both build, and the last one is kept
+                built = _Built(self.build(user), generation, now, local_writes)
             else:
-                d = date(d.year, d.month + 1, 1)
-        yield d
-
-    conversations_by_month = []
-    seeds_by_month = []
-    months = []
-
-    for d in all_months():
-        months.append(d.strftime('%B'))
-        conversations_by_month.append(conversations.get(d.month, 0)) # month number
-        seeds_by_month.append(seeds.get(d.month, 0))
-
-    return {
-        'dates': months,
-        'conversations': conversations_by_month,
-        'seeds': seeds_by_month,
+                built = built._replace(checked=now, local_writes=local_writes)
+        with self._lock:
+            self._built[user.pk] = built
+            self._built.move_to_end(user.pk)
+            while len(self._built) > self.size:
+                self._built.popitem(last=False)
+        return built.obj
+
+# The ?date= filters of the people and conversation lists: (value, days back)
+DATE_FILTERS = (
+    ('week', 7),
+    ('month', 30),
+    ('quarter', 91),
+    ('year', 365),
+)
+
+# Time windows for the dashboard "universe" counts: (key, label, days back).
+# A window of None days counts everyone ever contacted.
+ORBIT_WINDOWS = getattr(settings, 'ORBIT_WINDOWS', (
+    ('quarter', 'Past quarter', 91),
+    ('year', 'Past year', 365),
+    ('three_years', 'Past three years', 1096),
+    ('ever', 'Ever', None),
+))
+
+def count_orbits(qs, windows=None):
+    """Return how many people were contacted within each time window.
+
+    `qs` should be a Person queryset already scoped to a user. Every window is
+    counted from each person's stored last contact date with conditional
+    aggregation, so all windows cost a single query.
+    """
+    windows = ORBIT_WINDOWS if windows is None else windows
+    today = timezone.now().date()
+
+    aggregates = {}
+    for key, _, days in windows:
+        condition = {'last_contact__isnull': False}
+        if days is not None:
+            condition = {'last_contact__gte': today - timedelta(days=days)}
+        aggregates[key] = Count(Case(When(then=1, **condition), output_field=IntegerField()))
+
+    counts = qs.order_by().aggregate(**aggregates)
+
+    return [{
+        'key': key,
+        'label': label,
+        'days': days,
+        'count': counts[key] or 0,
+    } for key, label, days in windows]
+
+def day_start(d, offset=0):
+    """`d` itself, shifted by `offset` days."""
+    return d + timedelta(days=offset)
+
+def week_start(d, offset=0):
+    """Monday of the week containing `d`, shifted by `offset` weeks."""
+    return d - timedelta(days=d.weekday()) + timedelta(weeks=offset)
+
+def month_start(d, offset=0):
+    """First day of the month containing `d`, shifted by `offset` months."""
+    months = d.year * 12 + d.month - 1 + offset
+    return date(months // 12, months % 12 + 1, 1)
+
+def quarter_start(d, offset=0):
+    """First day of the quarter containing `d`, shifted by `offset` quarters."""
+    return month_start(date(d.year, d.month - (d.month - 1) % 3, 1), offset=offset * 3)
+
+def year_start(d, offset=0):
+    """January 1 of the year containing `d`, shifted by `offset` years."""
+    return date(d.year + offset, 1, 1)
+
+PERIOD_STARTS = {
+    'day': day_start,
+    'week': week_start,
+    'month': month_start,
+    'quarter': quarter_start,
+    'year': year_start,
+}
+
+# How many periods the trend chart shows when no range is given
+DEFAULT_PERIOD_COUNTS = {
+    'day': 30,
+    'week': 14,
+    'month': 12,
+    'quarter': 8,
+    'year': 5,
+}
+
+def period_label(period, start, long=False):
+    """Human-friendly label for the period beginning on `start`."""
+    if period == 'week':
+        # Label each week by its last day, a Sunday
+        start += timedelta(days=6)
+    if period in ('day', 'week'):
+        return start.strftime('%b %-d, %Y' if long else '%b %-d')
+    elif period == 'month':
+        return start.strftime('%b %Y' if long else '%B')
+    elif period == 'quarter':
+        return 'Q{0} {1}'.format((start.month - 1) // 3 + 1, start.year)
+    return str(start.year)
+
+def period_range(period, start=None, end=None):
+    """Return the [start, end) range covered by whole periods.
+
+    The range is widened to period boundaries; missing ends default to the
+    usual chart length up to and including the current period.
+    """
+    get_start = PERIOD_STARTS[period]
+    if end is None:
+        end = get_start(timezone.now().date(), offset=1)
+    else:
+        end = get_start(end - timedelta(days=1), offset=1)
+    if start is None:
+        start = get_start(end, offset=-DEFAULT_PERIOD_COUNTS[period])
+    else:
+        start = get_start(start)
+    return start, end
+
+def count_by_period(rows, period, start, end, by_mode=False):
+    """Bucket conversation counts into every period in [start, end).
+
+    `rows` yields (date, seed, mode, count) tuples at the same or a finer
+    granularity than `period`, e.g. daily counts or ConversationRollup rows.
+    Periods with no rows are filled with zeros.
+    """
+    get_start = PERIOD_STARTS[period]
+    starts = []
+    d = get_start(start)
+    while d < end:
+        starts.append(d)
+        d = get_start(d, offset=1)
+    index = {d: i for i, d in enumerate(starts)}
+
+    conversations = [0] * len(starts)
+    seeds = [0] * len(starts)
+    modes = {}
+    for day, seed, mode, n in rows:
+        i = index.get(get_start(day))
+        if i is None:
+            continue
+        if seed:
+            seeds[i] += n
+        else:
+            conversations[i] += n
+        if by_mode:
+            modes.setdefault(mode, [0] * len(starts))[i] += n
+
+    # Spell out the year once the range spans more than one
+    long = (end - start).days > 366
+    data = {
+        'period': period,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'dates': [period_label(period, d, long=long) for d in starts],
+        'conversations': conversations,
+        'seeds': seeds,
     }
+    if by_mode:
+        data['modes'] = modes
+    return data
@@ -1,20 +1,24 @@
 """Views for the app."""
+import csv
+import io
 from datetime import timedelta
 
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.db.models import Count, Q, Value, Max
-from django.db.models.functions import Concat
-from django.http import JsonResponse
-from django.shortcuts import redirect
+from django.db.models import Count, ExpressionWrapper, F, IntegerField
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse, reverse_lazy
 from django.utils import timezone
-from django.views.generic import TemplateView, ListView, DetailView, UpdateView, CreateView, DeleteView
+from django.utils.dateparse import parse_date
+from django.views.generic import View, TemplateView, FormView, ListView, DetailView, UpdateView, CreateView, DeleteView
 
-from .forms import PersonForm, ConversationForm, CompanyForm, SectorForm
-from .mixins import AccessMixin, UserFormMixin
+from . import autocomplete, dashboard, exporter, facets, graph, importer, metrics, search
+from .forms import PersonForm, ConversationForm, CompanyForm, SectorForm, ImportForm
+from .mixins import AccessMixin, ConditionalGetMixin, UserFormMixin
 from .models import Person, Sector, Company, Conversation
-from .utils import count_by_week, count_by_month
+from .pagination import KeysetPaginationMixin, decode_cursor, encode_cursor
+from .utils import DATE_FILTERS, ORBIT_WINDOWS, PERIOD_STARTS
 
 class Home(TemplateView):
     """Home page."""
@@ -27,38 +31,24 @@ class Home(TemplateView):
 
     def get_context_data(self):
         context = super(Home, self).get_context_data()
-        
-        ONE_QUARTER_AGO = timezone.now() - timedelta(days=91)
-        ONE_YEAR_AGO = timezone.now() - timedelta(days=365)
-        THREE_YEARS_AGO = timezone.now() - timedelta(days=365.24*3)
-        EVER = timezone.now() - timedelta(days=100000)
-        
-        new_people = (Person.objects.for_user(self.request.user)
-                .filter(created_on__gte=timezone.now() - timedelta(days=30))
-                .order_by('-created_on'))[:4]
-        conversation_list = (Conversation.objects.for_user(self.request.user).prefetch_related('people')
-                .filter(seed=False))[:4]
-        pings = (Person.objects.for_user(self.request.user)
-                .exclude(conversations__date__gte=ONE_QUARTER_AGO)
-                .filter(conversations__date__gte=THREE_YEARS_AGO)
-                .annotate(
-                    num_conversations=Count('conversations'),
-                    last_contact=Max('conversations__date'),
-                ).order_by('-num_conversations', '-last_contact'))[:4]
-        
-        orbit_quarter = Person.objects.filter(conversations__date__gte=ONE_QUARTER_AGO).distinct().count()
-        orbit_year = Person.objects.filter(conversations__date__gte=ONE_YEAR_AGO).distinct().count()
-        orbit_three_years = Person.objects.filter(conversations__date__gte=THREE_YEARS_AGO).distinct().count()
-        orbit_ever = Person.objects.filter(conversations__date__gte=EVER).distinct().count()
+
+        period = self.request.GET.get('period')
+        chart_period = period if period in PERIOD_STARTS else 'week'
+        chart_start = self.request.GET.get('start', '')
+        chart_end = self.request.GET.get('end', '')
+        try:
+            chart = (chart_period,) + dashboard.chart_range(chart_period, chart_start, chart_end)
+        except (ValueError, OverflowError):
+            # The chart asks the API, which shows the error
+            chart = None
+
+        context.update(dashboard.load(self.request.user, chart=chart))
         context.update({
-            'conversation_list': conversation_list,
-            'pings': pings,
-            'new_people': new_people,
-            'chart_period': self.request.GET.get('period', 'week'),
-            'orbit_quarter': orbit_quarter,
-            'orbit_year': orbit_year,
-            'orbit_three_years': orbit_three_years,
-            'orbit_ever': orbit_ever,
+            'chart_period': chart_period,
+            'chart_start': chart_start,
+            'chart_end': chart_end,
+            # Orbits the people list can show: those matching one of its date filters
+            'orbit_dates': [key for key, _, days in ORBIT_WINDOWS if (key, days) in DATE_FILTERS],
         })
         return context
 
@@ -71,11 +61,16 @@ class About(TemplateView):
             return redirect(reverse('home'))
         return super().dispatch(request, *args, **kwargs)
 
-class PersonList(LoginRequiredMixin, ListView):
+class PersonList(LoginRequiredMixin, ConditionalGetMixin, KeysetPaginationMixin, ListView):
     """List of people."""
     model = Person
     template_name = 'person/list.html'
     paginate_by = 20
+    keyset_ordering = ('-last_contact', 'last_name', 'first_name', 'pk')
+    # Other sort orders, by their ?order= value
+    orderings = {
+        'level': ('-level', 'last_name', 'first_name', 'pk'),
+    }
 
     def get_filters(self):
         """Record and validate filters from the GET parameters."""
@@ -88,6 +83,7 @@ class PersonList(LoginRequiredMixin, ListView):
         company = self.request.GET.get('company')
         city = self.request.GET.get('city')
         date = self.request.GET.get('date')
+        order = self.request.GET.get('order')
 
         selected_sector = None
         selected_company = None
@@ -106,12 +102,8 @@ class PersonList(LoginRequiredMixin, ListView):
                 pass
 
         if date:
-            date_since = {
-                'week': timezone.now() - timedelta(days=7),
-                'month': timezone.now() - timedelta(days=30),
-                'quarter': timezone.now() - timedelta(days=91),
-                'year': timezone.now() - timedelta(days=365),
-            }.get(date)
+            days = dict(DATE_FILTERS).get(date)
+            date_since = days and timezone.now() - timedelta(days=days)
         
         filters['sector'] = selected_sector
         filters['company'] = selected_company
@@ -119,6 +111,7 @@ class PersonList(LoginRequiredMixin, ListView):
         filters['level'] = None
         filters['date'] = date
         filters['date_since'] = date_since
+        filters['order'] = order if order in self.orderings else None
         filters['filtered'] = any([
             filters['sector'], filters['company'], filters['city'], filters['level'], filters['date'],
         ])
@@ -126,39 +119,47 @@ class PersonList(LoginRequiredMixin, ListView):
         self.filters = filters
         return self.filters
 
-    def get_queryset(self):
-        """Apply filters to the queryset."""
-        qs = (Person.objects.for_user(self.request.user)
-            .annotate(
-                num_conversations=Count('conversations'),
-                last_contact=Max('conversations__date')
-            ).order_by('-last_contact', 'last_name', 'first_name'))
+    def filter_queryset(self, skip=None):
+        """Apply every filter except `skip` to the user's people."""
+        qs = Person.objects.for_user(self.request.user)
         filters = self.get_filters()
 
-        if filters['sector']:
+        if filters['sector'] and skip != 'sector':
             qs = qs.filter(sectors=filters['sector'])
-        if filters['company']:
+        if filters['company'] and skip != 'company':
             qs = qs.filter(company=filters['company'])
-        if filters['date_since']:
-            qs = qs.filter(conversations__date__gte=filters['date_since'])
+        if filters['date_since'] and skip != 'date':
+            qs = qs.filter(last_contact__gte=filters['date_since'])
 
-        if filters['city']:
+        if filters['city'] and skip != 'city':
             qs = qs.filter(city__iexact=filters['city'])
 
         return qs
 
+    def get_queryset(self):
+        """Apply filters to the queryset."""
+        order = self.get_filters()['order']
+        if order:
+            self.keyset_ordering = self.orderings[order]
+        return self.filter_queryset().order_by(*self.keyset_ordering)
+
     def get_context_data(self):
-        """Add extra querysets to the context."""
+        """Add filter facets to the context."""
         context = super(PersonList, self).get_context_data()
-        companies = list(set([p.company for p in Person.objects.for_user(self.request.user) if p.company]))
-        companies.sort(key=lambda c: c.slug)
-        cities = list(set([p.city for p in Person.objects.for_user(self.request.user) if p.city]))
-        cities.sort()
+        filters = self.get_filters()
+        key = (
+            filters['sector'] and filters['sector'].pk,
+            filters['company'] and filters['company'].pk,
+            (filters['city'] or '').lower(),
+            filters['date_since'] and filters['date'],
+        )
+        person_facets = facets.person_facets(self.request.user, self.filter_queryset, key)
         context.update({
-            'sectors': Sector.objects.for_user(self.request.user),
-            'companies': companies,
-            'cities': cities,
-            'dates': ['week', 'month', 'quarter', 'year'],
+            'sectors': person_facets['sectors'],
+            'companies': person_facets['companies'],
+            'cities': person_facets['cities'],
+            'dates': [value for value, _ in DATE_FILTERS],
+            'orders': [('', 'Last contact'), ('level', 'Strongest')],
             'search': self.filters,
         })
         return context
@@ -194,52 +195,123 @@ class PersonDelete(AccessMixin, DeleteView):
     template_name = 'person/delete.html'
     success_url = reverse_lazy('person_list')
 
-class PersonAPI(LoginRequiredMixin, ListView):
+class PersonAPI(LoginRequiredMixin, ConditionalGetMixin, View):
     """Functions as a JSON API endpoint."""
-    model = Person
     paginate_by = 8
     http_method_names = ['get', 'head']
 
-    def get_queryset(self):
-        """Apply search term"""
-        qs = (Person.objects.for_user(self.request.user)
-                .select_related('partner', 'known_via')
-                .annotate(
-                    num_conversations=Count('conversations'),
-                    full_name=Concat('first_name', Value(' '), 'last_name'))
-                .order_by('-num_conversations', 'first_name', 'last_name')
-            )
-
-        # Filter using search term
-        q = self.request.GET.get('q')
-        if q:
-            q = q.lower().strip()
-            qs = qs.filter(Q(full_name__istartswith=q) | Q(last_name__istartswith=q))
-        
-        return qs
-
     def get(self, request, *args, **kwargs):
-        """Convert to JSON response"""
-        self.object_list = self.get_queryset()
-        context = self.get_context_data()
-        people_list = list(context['object_list'])
-        people = [{
-            'name': p.name,
-            'id': p.slug,
-        } for p in people_list]
+        """Look up the search term in the user's in-memory index.
+
+        Pass the returned `next_cursor` as `cursor` to continue; `page` is
+        still accepted for older clients. Form widgets ask for `key=pk` to get
+        primary keys instead of slugs, and can `exclude` one person.
+        """
+        cursor = decode_cursor(request.GET.get('cursor')) or {}
+        after = cursor.get('after', -1)
+        page = cursor.get('page', 1)
+        if not isinstance(after, int) or not isinstance(page, int):
+            return JsonResponse({'error': 'Invalid cursor.'}, status=400)
+        offset = 0
+        if not cursor:
+            try:
+                page = max(int(request.GET.get('page', 1)), 1)
+            except ValueError:
+                page = 1
+            offset = (page - 1) * self.paginate_by
+
+        try:
+            exclude = int(request.GET.get('exclude', ''))
+        except ValueError:
+            exclude = None
+
+        index = autocomplete.get_index(request.user)
+        people, next_after = index.search(request.GET.get('q', ''),
+            offset=offset, limit=self.paginate_by, after=after, exclude=exclude)
+
+        key = 'pk' if request.GET.get('key') == 'pk' else 'slug'
+        people = [{'name': p['name'], 'id': p[key]} for p in people]
+
+        next_cursor = None
+        if next_after is not None:
+            next_cursor = encode_cursor({'after': next_after, 'page': page + 1})
 
         data = {
-            'page': context['page_obj'].number,
-            'more_results': context['page_obj'].has_next(),
+            'page': page,
+            'more_results': next_cursor is not None,
+            'next_cursor': next_cursor,
             'people': people,
         }
         return JsonResponse(data)
 
-class ConversationList(LoginRequiredMixin, ListView):
+class PersonConnectionsAPI(LoginRequiredMixin, ConditionalGetMixin, View):
+    """How the user knows a person, and who can introduce them."""
+    http_method_names = ['get', 'head']
+    max_hops = 3
+    max_neighbors = 100
+
+    def get(self, request, *args, **kwargs):
+        """Return the shortest `path` of links from the user to the person, and the `neighbors`.
+
+        The `introducer` is the person the user knows first on that path.
+        `neighbors` are everyone within ?hops= links (default 2) of the person.
+        """
+        person = get_object_or_404(Person.objects.for_user(request.user).only('pk', 'slug'),
+            slug=kwargs['slug'])
+        try:
+            hops = int(request.GET.get('hops', 2))
+        except ValueError:
+            hops = 0
+        if not 1 <= hops <= self.max_hops:
+            return JsonResponse({'error': 'hops must be between 1 and {0}.'.format(self.max_hops)},
+                status=400)
+
+        people = graph.get_graph(request.user)
+        path = people.path(person.pk)
+        neighbors = people.neighborhood(person.pk, hops)
+        return JsonResponse({
+            'path': path,
+            'introducer': path[1] if path and len(path) > 2 else None,
+            'neighbors': neighbors[:self.max_neighbors],
+            'more_neighbors': len(neighbors) > self.max_neighbors,
+        })
+
+class BirthdayAPI(LoginRequiredMixin, ConditionalGetMixin, View):
+    """The user's people with a birthday coming up."""
+    http_method_names = ['get', 'head']
+    max_days = 60
+    max_people = 100
+
+    def get(self, request, *args, **kwargs):
+        """Return the `people` with a birthday in the next ?days= days (default 14), today included."""
+        try:
+            days = int(request.GET.get('days', 14))
+        except ValueError:
+            days = 0
+        if not 1 <= days <= self.max_days:
+            return JsonResponse({'error': 'days must be between 1 and {0}.'.format(self.max_days)},
+                status=400)
+
+        people = Person.objects.upcoming_birthdays(request.user, days=days, limit=self.max_people + 1)
+        return JsonResponse({
+            'days': days,
+            'people': [{
+                'name': person.name,
+                'id': person.slug,
+                'birthday': person.next_birthday.isoformat(),
+                'days_until': person.days_until,
+            } for person in people[:self.max_people]],
+            'more_people': len(people) > self.max_people,
+        })
+
+class ConversationList(LoginRequiredMixin, ConditionalGetMixin, KeysetPaginationMixin, ListView):
     """List all conversations, optionally for a single person or sector."""
     model = Conversation
     template_name = 'conversations/list.html'
     paginate_by = 20
+    # The hashid primary key only supports equality lookups, so the integer id
+    # is exposed as `seq` to break ties
+    keyset_ordering = ('-date', 'mode', 'seq')
 
     def get_filters(self):
         """Record and validate filters from the GET parameters."""
@@ -271,12 +343,8 @@ class ConversationList(LoginRequiredMixin, ListView):
                 pass
 
         if date:
-            date_since = {
-                'week': timezone.now() - timedelta(days=7),
-                'month': timezone.now() - timedelta(days=30),
-                'quarter': timezone.now() - timedelta(days=91),
-                'year': timezone.now() - timedelta(days=365),
-            }.get(date)
+            days = dict(DATE_FILTERS).get(date)
+            date_since = days and timezone.now() - timedelta(days=days)
         
         filters['sector'] = selected_sector
         filters['mode'] = mode
@@ -291,33 +359,48 @@ class ConversationList(LoginRequiredMixin, ListView):
         self.filters = filters
         return self.filters
 
-    def get_queryset(self):
-        """Apply filters to the queryset."""
-        qs = Conversation.objects.for_user(self.request.user).prefetch_related('people')
+    def filter_queryset(self, skip=None):
+        """Apply every filter except `skip` to the user's conversations."""
+        qs = Conversation.objects.for_user(self.request.user)
         filters = self.get_filters()
 
-        if filters['sector']:
-            qs = qs.filter(people__sectors=filters['sector']).distinct()
-        if filters['mode']:
+        if filters['sector'] and skip != 'sector':
+            qs = qs.filter(people__sectors=filters['sector'])
+        if filters['mode'] and skip != 'mode':
             qs = qs.filter(mode__iexact=filters['mode'])
-        if filters['date_since']:
+        if filters['date_since'] and skip != 'date':
             qs = qs.filter(date__gte=filters['date_since'])
-        if filters['seeds']:
+        if filters['seeds'] and skip != 'seeds':
             qs = qs.filter(seed=True)
-        if filters['person']:
+        if filters['person'] and skip != 'person':
             qs = qs.filter(people=filters['person'])
 
-        return qs.distinct()
+        return qs
+
+    def get_queryset(self):
+        """Apply filters to the queryset."""
+        return (self.filter_queryset()
+            .annotate(seq=ExpressionWrapper(F('id'), output_field=IntegerField()))
+            .distinct())
 
     def get_context_data(self):
-        """Add extra querysets to the context."""
+        """Add filter facets to the context."""
         context = super(ConversationList, self).get_context_data()
-        people = Person.objects.for_user(self.request.user).filter(conversations__isnull=False).distinct()
+        filters = self.get_filters()
+        key = (
+            filters['sector'] and filters['sector'].pk,
+            (filters['mode'] or '').lower(),
+            filters['date_since'] and filters['date'],
+            filters['seeds'],
+            filters['person'] and filters['person'].pk,
+        )
+        conversation_facets = facets.conversation_facets(self.request.user, self.filter_queryset, key,
+            person=filters['person'])
         context.update({
-            'sectors': Sector.objects.for_user(self.request.user),
-            'people': people,
-            'modes': [c for c in Conversation.MODES if c[0]],
-            'dates': ['week', 'month', 'quarter', 'year'],
+            'sectors': conversation_facets['sectors'],
+            'people': conversation_facets['people'],
+            'modes': conversation_facets['modes'],
+            'dates': [value for value, _ in DATE_FILTERS],
             'search': self.filters,
         })
         return context
@@ -366,7 +449,7 @@ class ConversationDelete(AccessMixin, DeleteView):
     template_name = 'conversations/delete.html'
     success_url = reverse_lazy('conversation_list')
 
-class CompanyList(LoginRequiredMixin, ListView):
+class CompanyList(LoginRequiredMixin, ConditionalGetMixin, ListView):
     """List all companies."""
     model = Company
     template_name = 'companies/list.html'
@@ -400,7 +483,7 @@ class CompanyDelete(AccessMixin, DeleteView):
     template_name = 'companies/delete.html'
     success_url = reverse_lazy('company_list')
 
-class SectorList(LoginRequiredMixin, ListView):
+class SectorList(LoginRequiredMixin, ConditionalGetMixin, ListView):
     """List all sectors."""
     model = Sector
     template_name = 'sectors/list.html'
@@ -436,15 +519,138 @@ class SectorDelete(AccessMixin, DeleteView):
     success_url = reverse_lazy('sector_list')
 
 
-class TrendAPI(LoginRequiredMixin, TemplateView):
+class Search(LoginRequiredMixin, TemplateView):
+    """Full-text search over conversations and people's notes."""
+    template_name = 'search.html'
+    paginate_by = 20
+
+    def get_filters(self):
+        """Record and validate filters from the GET parameters."""
+        filters = {}
+
+        sector = self.request.GET.get('sector')
+        person = self.request.GET.get('person')
+
+        selected_sector = None
+        selected_person = None
+
+        if sector:
+            try:
+                selected_sector = Sector.objects.for_user(self.request.user).get(slug=sector)
+            except Sector.DoesNotExist:
+                pass
+
+        if person:
+            try:
+                selected_person = Person.objects.for_user(self.request.user).get(slug=person)
+            except Person.DoesNotExist:
+                pass
+
+        try:
+            start = parse_date(self.request.GET.get('start') or '')
+            end = parse_date(self.request.GET.get('end') or '')
+        except ValueError:
+            start = end = None
+
+        filters['q'] = self.request.GET.get('q', '').strip()
+        filters['sector'] = selected_sector
+        filters['person'] = selected_person
+        filters['start'] = start
+        filters['end'] = end
+        filters['filtered'] = any([
+            filters['sector'], filters['person'], filters['start'], filters['end'],
+        ])
+        return filters
+
+    def get_context_data(self, **kwargs):
+        context = super(Search, self).get_context_data(**kwargs)
+        filters = self.get_filters()
+        try:
+            page = max(int(self.request.GET.get('page', 1)), 1)
+        except ValueError:
+            page = 1
+
+        results, has_next = search.search(self.request.user, filters['q'],
+            person=filters['person'],
+            sector=filters['sector'],
+            date_since=filters['start'],
+            date_until=filters['end'],
+            offset=(page - 1) * self.paginate_by,
+            limit=self.paginate_by)
+
+        context.update({
+            'results': results,
+            'page': page,
+            'has_next': has_next,
+            'sectors': Sector.objects.for_user(self.request.user),
+            'search': filters,
+        })
+        return context
+
+class Import(LoginRequiredMixin, FormView):
+    """Upload people or conversations in bulk."""
+    form_class = ImportForm
+    template_name = 'import.html'
+
+    def form_valid(self, form):
+        upload = form.cleaned_data['file']
+        kind = form.cleaned_data['kind']
+        imp = importer.Importer(self.request.user)
+        # Read the upload as text, row by row, rather than all at once
+        f = io.TextIOWrapper(upload.file, encoding='utf-8-sig', newline='')
+        try:
+            imp.run(kind, importer.read(f, importer.guess_format(upload.name)))
+        except (UnicodeDecodeError, csv.Error) as e:
+            form.add_error('file', 'Could not read the file: {0}'.format(e))
+            return self.form_invalid(form)
+        finally:
+            f.detach()
+
+        messages.success(self.request, 'Imported {0} {1}.'.format(imp.created, kind))
+        return self.render_to_response(self.get_context_data(
+            form=self.get_form_class()(), errors=imp.errors))
+
+class Export(LoginRequiredMixin, View):
+    """Download people, conversations, companies or sectors (or, as JSON, all of them)."""
+    content_types = {
+        'csv': 'text/csv',
+        'json': 'application/json',
+    }
+
+    def get(self, request, kind, fmt):
+        if kind not in exporter.KINDS and not (kind == 'all' and fmt == 'json'):
+            raise Http404('No such export')
+        # Streamed so the download starts at once and memory stays flat
+        response = StreamingHttpResponse(exporter.export(request.user, kind, fmt),
+            content_type='{0}; charset=utf-8'.format(self.content_types[fmt]))
+        response['Content-Disposition'] = 'attachment; filename="seeds-{0}-{1:%Y-%m-%d}.{2}"'.format(
+            kind, timezone.now(), fmt)
+        return response
+
+class TrendAPI(LoginRequiredMixin, ConditionalGetMixin, TemplateView):
     """Returns data with the trend in conversations."""
     http_method_names = ['get', 'head']
 
+    max_periods = 500
+
     def get(self, request, *args, **kwargs):
-        """Calculate data"""
+        """Calculate data for ?period=day|week|month|quarter|year&start=&end=.
+
+        `start` and `end` are optional ISO dates bounding the range [start, end).
+        """
         period = request.GET.get('period', 'week')
-        if period == 'week':
-            data = count_by_week(Conversation.objects.for_user(self.request.user), days=90)
-        else:
-            data = count_by_month(Conversation.objects.for_user(self.request.user), months=12)
+        try:
+            start, end = dashboard.chart_range(period, request.GET.get('start'),
+                request.GET.get('end'), max_periods=self.max_periods)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        data = dashboard.trend(request.user, period, start, end, by_mode=request.GET.get('by') == 'mode')
         return JsonResponse(data)
+
+class Metrics(View):
+    """Request metrics for Prometheus, for staff or the scrapers allowed in settings."""
+    def get(self, request):
+        if not (request.user.is_staff or metrics.is_scraper(request)):
+            raise Http404('No such page')
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,42 @@
+"""Form widgets."""
+from django import forms
+from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
+
+class RemoteSelectMixin(object):
+    """Select that only renders its selected options.
+
+    The other options are fetched page by page by select2 from `url`, so the
+    page size does not grow with the number of choices. The form field still
+    validates submitted values against its queryset.
+    """
+    url = None
+
+    def get_context(self, name, value, attrs):
+        attrs = dict(attrs or {}, **{'data-ajax-url': str(self.url)})
+        return super(RemoteSelectMixin, self).get_context(name, value, attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        """The empty option, if any, and one option per selected object."""
+        field = self.choices.field
+        groups = []
+        if not self.allow_multiple_selected and field.empty_label is not None:
+            groups.append((None, [self.create_option(name, '', field.empty_label,
+                not any(value), 0, attrs=attrs)], 0))
+
+        selected = [v for v in value if v not in ('', None)]
+        try:
+            objects = list(self.choices.queryset.filter(pk__in=selected)) if selected else []
+        except (ValueError, TypeError, ValidationError):
+            objects = []
+        for obj in objects:
+            index = len(groups)
+            groups.append((None, [self.create_option(name, field.prepare_value(obj),
+                field.label_from_instance(obj), True, index, attrs=attrs)], index))
+        return groups
+
+class PersonSelect(RemoteSelectMixin, forms.Select):
+    url = reverse_lazy('person_api')
+
+class PersonSelectMultiple(RemoteSelectMixin, forms.SelectMultiple):
+    url = reverse_lazy('person_api')
@@ -36,10 +36,11 @@ INSTALLED_APPS = [
     # third party apps
     'crispy_forms',
     # my apps
-    'seeds',
+    'seeds.apps.SeedsConfig',
 ]
 
 MIDDLEWARE = [
+    'seeds.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,6 +64,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'seeds.context_processors.fragment_version',
             ],
         },
     },
@@ -89,6 +91,19 @@ USE_I18N = False
 USE_L10N = True
 USE_TZ = True
 
+###### METRICS
+# Shared by all worker processes; see seeds/metrics.py
+METRICS_DB = os.path.join(PROJECT_ROOT, 'metrics.sqlite3')
+METRICS_FLUSH_SECONDS = 5
+# Log requests slower than this (None to turn off) with their slowest queries
+SLOW_REQUEST_SECONDS = 1.0
+SLOW_REQUEST_QUERIES = 5
+# Who may read /metrics besides staff users. Behind a reverse proxy every request
+# comes from the proxy's address, so give scrapers a token, which they send as
+# "Authorization: Bearer <token>", rather than allowing an address.
+METRICS_TOKEN = None
+METRICS_ALLOWED_IPS = []
+
 ###### LOGGING
 # This overrides Django's default logging configuration to not email admins
 # because we have sentry for that
@@ -119,6 +134,11 @@ LOGGING = {
             'class': 'logging.StreamHandler',
             'formatter': 'simple',
         },
+        'slow_requests': {
+            'level': 'WARNING',
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
     },
     'loggers': {
         'django': {
@@ -127,6 +147,10 @@ LOGGING = {
         'py.warnings': {
             'handlers': ['console'],
         },
+        'seeds.metrics': {
+            'handlers': ['slow_requests'],
+            'level': 'WARNING',
+        },
     }
 }
 
@@ -0,0 +1,44 @@
+"""Settings for serving with several worker processes on SQLite.
+
+Import from this module in the deployed settings, or point
+DJANGO_SETTINGS_MODULE at it. See seeds/database.py.
+"""
+import os
+
+from .defaults import *  # noqa: F401,F403  pylint: disable=wildcard-import
+
+# Run on every new connection. WAL lets reads go on while a write commits,
+# and NORMAL sync is safe in WAL mode (a power loss can only drop the last commits).
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+DATABASES = {
+    'default': dict(DATABASES['default'], CONN_MAX_AGE=600, PRAGMAS=SQLITE_PRAGMAS),
+}
+# A second connection to the same file for the pages that only read
+DATABASES['read'] = dict(DATABASES['default'],
+    PRAGMAS=dict(SQLITE_PRAGMAS, query_only='ON'),
+    TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['seeds.database.ReadRouter']
+MIDDLEWARE.insert(MIDDLEWARE.index('django.contrib.messages.middleware.MessageMiddleware') + 1,
+    'seeds.database.ReadDatabaseMiddleware')
+
+# One cache for all the workers, so a result computed by one (facets, trend data,
+# rendered list items) serves the others. Entries are keyed on the per-user
+# DataVersion counters in the database, so a per-process cache would still be
+# correct, only colder.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(PROJECT_ROOT, 'cache'),
+        'TIMEOUT': 60 * 60,
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}